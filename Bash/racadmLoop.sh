@@ -1,15 +1,47 @@
 #!/bin/bash
-while getopts u:p:f: flag
+# -c  File of racadm commands, one per line, run against each iDRAC
+# -s  Run the commands over one SSH connection per iDRAC (ControlMaster) instead of logging in with remote racadm
+#     for every command. Requires sshpass when a password is given with -p
+while getopts u:p:f:c:s flag
 do
     case "${flag}" in
         u) username=${OPTARG};;
         p) password=${OPTARG};;
         f) filename=${OPTARG};;
+        c) commandsfile=${OPTARG};;
+        s) usessh=1;;
     esac
 done
 
+commands=()
+if [ -n "$commandsfile" ]; then
+    while read command || [[ -n $command ]];
+    do
+        [[ -z "$command" || "$command" == \#* ]] && continue
+        commands+=("$command")
+    done < "$commandsfile"
+else
+    commands+=("get System.ServerTopology")
+fi
+
 cat $filename | while read line || [[ -n $line ]];
 do
     echo "Connecting to $line"
-    racadm --nocertwarn -r $line -u $username -p "$password"  get System.ServerTopology
-done
\ No newline at end of file
+    if [ -n "$usessh" ]; then
+        control="/tmp/racadmLoop-$$-$line"
+        sshopts=(-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o LogLevel=ERROR -o ControlPath="$control")
+        # Log in once and keep the master connection open in the background for the commands below
+        SSHPASS="$password" sshpass -e ssh "${sshopts[@]}" -o ControlMaster=yes -o ControlPersist=60 -fN "$username@$line" < /dev/null
+        for command in "${commands[@]}";
+        do
+            echo "racadm $command"
+            ssh "${sshopts[@]}" "$username@$line" "racadm $command" < /dev/null
+        done
+        ssh "${sshopts[@]}" -O exit "$username@$line" 2> /dev/null
+    else
+        for command in "${commands[@]}";
+        do
+            racadm --nocertwarn -r $line -u $username -p "$password" $command < /dev/null
+        done
+    fi
+done
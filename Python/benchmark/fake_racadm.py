@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2022, Dell, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+# Stand-in for the racadm executable used to test and benchmark racadmLoop.py and scriptLoop.py offline.
+# Accepts the same remote options as racadm (-r, -u, -p, --nocertwarn), waits to simulate the iDRAC and prints
+# racadm style output. Behaviour is set with environment variables:
+#   FAKE_RACADM_LATENCY  Seconds each command takes (default 0.05)
+#   FAKE_RACADM_JITTER   Up to this many extra seconds are randomly added (default 0)
+#   FAKE_RACADM_FAILURE  Fraction of commands that fail with a login error (default 0)
+#   FAKE_RACADM_LOG      Append one JSON line per command with the host, command, exit code and duration
+#
+# System Requirements
+# Python 3.x
+import json, os, random, sys, time
+
+def parse_args(argv):
+    host, command = None, []
+    i = 0
+    while i < len(argv):
+        if argv[i] in ('-r', '-u', '-p', '-ip'):
+            if argv[i] in ('-r', '-ip'):
+                host = argv[i + 1]
+            i += 2
+            continue
+        if argv[i] != '--nocertwarn':
+            command.append(argv[i])
+        i += 1
+    return host, command
+
+def respond(command):
+    if len(command) >= 2 and command[0] == 'get':
+        group = command[1]
+        if '.' in group and not group.endswith('.'):
+            return "[Key=%s]\n%s=FakeValue" % (group.rsplit('.', 1)[0] + '.1', group.rsplit('.', 1)[1])
+        return "[Key=%s.1]\nAttribute1=Enabled\nAttribute2=Disabled\nAttribute3=FakeValue" % group
+    if len(command) >= 1 and command[0] == 'set':
+        return "Object value modified successfully"
+    return "Command completed successfully"
+
+if __name__ == "__main__":
+    started = time.monotonic()
+    host, command = parse_args(sys.argv[1:])
+    latency = float(os.environ.get('FAKE_RACADM_LATENCY', 0.05)) + random.uniform(0, float(os.environ.get('FAKE_RACADM_JITTER', 0)))
+    time.sleep(latency)
+    if random.random() < float(os.environ.get('FAKE_RACADM_FAILURE', 0)):
+        print("ERROR: Unable to connect to RAC at specified IP address.")
+        returncode = 1
+    else:
+        print(respond(command))
+        returncode = 0
+    if os.environ.get('FAKE_RACADM_LOG'):
+        entry = json.dumps({'host': host, 'command': ' '.join(command), 'returncode': returncode, 'duration': time.monotonic() - started, 'time': time.time()})
+        # A single small write in append mode is atomic so parallel workers can share the log
+        with open(os.environ['FAKE_RACADM_LOG'], 'a') as log_file:
+            log_file.write(entry + '\n')
+    sys.exit(returncode)
@@ -0,0 +1,347 @@
+#
+# Copyright (c) 2022, Dell, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+"""
+#### Synopsis
+Local stand-in for an OME appliance used to test and benchmark get_configuration_baselines.py without real hardware.
+
+#### Description
+Emulates the SessionService, TemplateService/Baselines, DeviceConfigComplianceReports and DeviceComplianceDetails
+endpoints over HTTPS, including @odata.count, @odata.nextLink, $top, $skip and simple $filter expressions. Every
+request is delayed by --latency seconds plus up to --jitter seconds. Requests can be logged as JSON lines with --log.
+Only the Python standard library and the openssl command are needed, so it runs offline.
+
+The port the server is listening on is printed to stdout once it is ready.
+
+#### Python Example
+`python mock_ome_server.py --port 8443 --devices 5000 --page-size 50 --latency 0.05`
+`python get_configuration_baselines.py -i 127.0.0.1:8443 -u admin -p admin -b Baseline1 -r`
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import signal
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from argparse import RawTextHelpFormatter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+BASELINES_PATH = re.compile(r"^/api/TemplateService/Baselines$")
+REPORT_PATH = re.compile(r"^/api/TemplateService/Baselines\((\d+)\)/DeviceConfigComplianceReports$")
+DETAILS_PATH = re.compile(r"^/api/TemplateService/Baselines\((\d+)\)/DeviceConfigComplianceReports\((\d+)\)"
+                          r"/DeviceComplianceDetails$")
+SESSIONS_PATH = re.compile(r"^/api/SessionService/Sessions$")
+SESSION_PATH = re.compile(r"^/api/SessionService/Sessions\('([^']+)'\)$")
+FILTER_EXPRESSION = re.compile(r"^\s*(\w+)\s+(eq|ne|gt|ge|lt|le)\s+'?([^']*)'?\s*$")
+
+
+class MockOME:
+    """
+    The data served by the mock appliance and the sessions it has issued
+
+    Args:
+        devices: Number of devices in each baseline compliance report
+        baselines: Number of configuration baselines
+        attributes: Number of attributes in each device's compliance details
+        page_size: Number of results per page when the client does not send $top
+        noncompliant: Fraction of devices reported as not compliant
+    """
+
+    def __init__(self, devices: int = 100, baselines: int = 1, attributes: int = 10, page_size: int = 50,
+                 noncompliant: float = 0.1):
+        self.page_size = page_size
+        self.attributes = attributes
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.baselines = [{"Id": baseline_id,
+                           "Name": "Baseline%d" % baseline_id,
+                           "Description": "Mock configuration baseline",
+                           "TemplateId": 10 + baseline_id,
+                           "LastRun": "2022-01-01 00:00:00.000"} for baseline_id in range(1, baselines + 1)]
+        generator = random.Random(0)
+        self.reports = {}
+        for baseline in self.baselines:
+            self.reports[baseline["Id"]] = [
+                {"Id": entry_id,
+                 "DeviceId": 10000 + entry_id,
+                 "ServiceTag": "MOCK%03d" % entry_id,
+                 "DeviceName": "idrac-%05d" % entry_id,
+                 "Model": "PowerEdge R650",
+                 "ComplianceStatus": "NOT_COMPLIANT" if generator.random() < noncompliant else "COMPLIANT",
+                 "InventoryTime": "2022-01-01 00:00:00.000"} for entry_id in range(1, devices + 1)]
+
+    def create_session(self) -> tuple:
+        session_id = str(uuid.uuid4())
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.sessions[token] = session_id
+        return session_id, token
+
+    def delete_session(self, session_id: str) -> bool:
+        with self.lock:
+            for token, existing_id in list(self.sessions.items()):
+                if existing_id == session_id:
+                    del self.sessions[token]
+                    return True
+        return False
+
+    def is_authenticated(self, token: str) -> bool:
+        with self.lock:
+            return token in self.sessions
+
+    def details(self, baseline_id: int, entry_id: int) -> list:
+        return [{"Id": attribute_id,
+                 "AttributeName": "Attribute%d" % attribute_id,
+                 "ExpectedValue": "Enabled",
+                 "CurrentValue": "Enabled" if (entry_id + attribute_id) % 7 else "Disabled",
+                 "ComplianceStatus": "COMPLIANT" if (entry_id + attribute_id) % 7 else "NOT_COMPLIANT"}
+                for attribute_id in range(1, self.attributes + 1)]
+
+
+def apply_filter(items: list, odata_filter: str) -> list:
+    """
+    Applies a single "Property op 'value'" OData comparison. Anything more complex raises ValueError, which the server
+    answers with HTTP 400 the same way OME does for filters it does not support.
+    """
+
+    match = FILTER_EXPRESSION.match(odata_filter)
+    if not match:
+        raise ValueError("Unsupported filter: " + odata_filter)
+    field, operator, value = match.groups()
+    compare = {'eq': lambda a, b: a == b, 'ne': lambda a, b: a != b, 'gt': lambda a, b: a > b,
+               'ge': lambda a, b: a >= b, 'lt': lambda a, b: a < b, 'le': lambda a, b: a <= b}[operator]
+    filtered = []
+    for item in items:
+        if field not in item:
+            raise ValueError("Unknown property: " + field)
+        item_value = item[field]
+        if isinstance(item_value, (int, float)):
+            value_to_compare = type(item_value)(value)
+        else:
+            value_to_compare = value
+        if compare(item_value, value_to_compare):
+            filtered.append(item)
+    return filtered
+
+
+class MockOMEHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'MockOME/1.0'
+
+    def log_message(self, format, *args):
+        # The default handler writes every request to stderr. Requests are logged with --log instead.
+        pass
+
+    def _delay(self):
+        latency = self.server.latency + random.uniform(0, self.server.jitter)
+        if latency > 0:
+            time.sleep(latency)
+
+    def _send_json(self, status: int, body=None, headers: dict = None):
+        payload = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+        return status
+
+    def _error(self, status: int, message: str):
+        return self._send_json(status, {"error": {"code": "Base.1.0.GeneralError", "message": message}})
+
+    def _collection(self, path: str, query: dict, items: list):
+        odata_filter = query.get('$filter', [None])[0]
+        if odata_filter:
+            try:
+                items = apply_filter(items, odata_filter)
+            except ValueError as err:
+                return self._error(400, str(err)), False
+        top = int(query.get('$top', [self.server.ome.page_size])[0])
+        skip = int(query.get('$skip', [0])[0])
+        body = {"@odata.context": "/api/$metadata", "@odata.count": len(items), "value": items[skip:skip + top]}
+        if skip + top < len(items):
+            next_query = "$skip=%d&$top=%d" % (skip + top, top)
+            if odata_filter:
+                next_query = "$filter=%s&%s" % (odata_filter, next_query)
+            body["@odata.nextLink"] = path + "?" + next_query
+        return self._send_json(200, body), True
+
+    def _record(self, method: str, status: int, started: float, page: bool):
+        if self.server.log_file is None:
+            return
+        entry = {"method": method, "path": self.path, "status": status, "page": page,
+                 "duration": time.monotonic() - started, "time": time.time()}
+        with self.server.log_lock:
+            self.server.log_file.write(json.dumps(entry) + '\n')
+            self.server.log_file.flush()
+
+    def do_POST(self):
+        started = time.monotonic()
+        self._delay()
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else b''
+        path = urlparse(self.path).path
+        if SESSIONS_PATH.match(path):
+            try:
+                credentials = json.loads(body or b'{}')
+            except ValueError:
+                credentials = {}
+            if credentials.get('UserName') and credentials.get('Password'):
+                session_id, token = self.server.ome.create_session()
+                status = self._send_json(201, {"Id": session_id, "UserName": credentials['UserName']},
+                                         {"X-Auth-Token": token, "Location": path + "('%s')" % session_id})
+            else:
+                status = self._error(401, "Invalid credentials")
+        else:
+            status = self._error(404, "Not found")
+        self._record('POST', status, started, False)
+
+    def do_DELETE(self):
+        started = time.monotonic()
+        self._delay()
+        match = SESSION_PATH.match(urlparse(self.path).path)
+        if not self.server.ome.is_authenticated(self.headers.get('X-Auth-Token')):
+            status = self._error(401, "Unauthorized")
+        elif match and self.server.ome.delete_session(match.group(1)):
+            status = self._send_json(204)
+        else:
+            status = self._error(404, "Not found")
+        self._record('DELETE', status, started, False)
+
+    def do_GET(self):
+        started = time.monotonic()
+        self._delay()
+        parsed = urlparse(self.path)
+        path = parsed.path
+        query = parse_qs(parsed.query)
+        ome = self.server.ome
+        page = False
+        if not ome.is_authenticated(self.headers.get('X-Auth-Token')):
+            status = self._error(401, "Unauthorized")
+        elif BASELINES_PATH.match(path):
+            status, page = self._collection(path, query, ome.baselines)
+        elif REPORT_PATH.match(path):
+            baseline_id = int(REPORT_PATH.match(path).group(1))
+            if baseline_id in ome.reports:
+                status, page = self._collection(path, query, ome.reports[baseline_id])
+            else:
+                status = self._error(404, "Baseline not found")
+        elif DETAILS_PATH.match(path):
+            baseline_id, entry_id = (int(group) for group in DETAILS_PATH.match(path).groups())
+            if baseline_id in ome.reports and 0 < entry_id <= len(ome.reports[baseline_id]):
+                status, page = self._collection(path, query, ome.details(baseline_id, entry_id))
+            else:
+                status = self._error(404, "Report entry not found")
+        else:
+            status = self._error(404, "Not found")
+        self._record('GET', status, started, page)
+
+
+def create_certificate(directory: str) -> tuple:
+    """
+    Creates a self-signed certificate for localhost with the openssl command
+
+    Returns: A tuple of the certificate and key file paths
+    """
+
+    if shutil.which('openssl') is None:
+        raise Exception("The openssl command is needed to create a certificate. Pass --cert and --key instead.")
+    cert_file = os.path.join(directory, 'mock_ome.crt')
+    key_file = os.path.join(directory, 'mock_ome.key')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=localhost',
+                    '-keyout', key_file, '-out', cert_file], check=True, stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL)
+    return cert_file, key_file
+
+
+def create_server(host: str = '127.0.0.1', port: int = 0, ome: MockOME = None, latency: float = 0,
+                  jitter: float = 0, cert_file: str = None, key_file: str = None, log_file=None) -> ThreadingHTTPServer:
+    """
+    Creates the mock OME HTTPS server. Call serve_forever() on the result to start it.
+
+    Args:
+        host: Address to listen on
+        port: Port to listen on, 0 picks a free port
+        ome: The MockOME holding the data to serve
+        latency: Seconds every request is delayed by
+        jitter: Up to this many extra seconds are randomly added to every request
+        cert_file: TLS certificate. A self-signed one is created when not given
+        key_file: TLS private key
+        log_file: Optional file object every request is logged to as a JSON line
+    """
+
+    server = ThreadingHTTPServer((host, port), MockOMEHandler)
+    server.daemon_threads = True
+    server.ome = ome or MockOME()
+    server.latency = latency
+    server.jitter = jitter
+    server.log_file = log_file
+    server.log_lock = threading.Lock()
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    if cert_file:
+        context.load_cert_chain(cert_file, key_file)
+    else:
+        # The files are only needed while they are loaded, so nothing is left behind however the server is stopped
+        cert_dir = tempfile.mkdtemp(prefix='mock_ome_')
+        try:
+            context.load_cert_chain(*create_certificate(cert_dir))
+        finally:
+            shutil.rmtree(cert_dir, ignore_errors=True)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
+    parser.add_argument("--host", required=False, default='127.0.0.1', help="Address to listen on")
+    parser.add_argument("--port", required=False, type=int, default=0, help="Port to listen on, 0 picks a free port")
+    parser.add_argument("--devices", required=False, type=int, default=100,
+                        help="Number of devices in each baseline compliance report")
+    parser.add_argument("--baselines", required=False, type=int, default=1, help="Number of configuration baselines")
+    parser.add_argument("--attributes", required=False, type=int, default=10,
+                        help="Number of attributes in each device's compliance details")
+    parser.add_argument("--page-size", required=False, type=int, default=50,
+                        help="Results per page when the client does not send $top")
+    parser.add_argument("--latency", required=False, type=float, default=0, help="Seconds every request is delayed by")
+    parser.add_argument("--jitter", required=False, type=float, default=0,
+                        help="Up to this many extra seconds are randomly added to every request")
+    parser.add_argument("--cert", required=False, help="TLS certificate file. A self-signed one is created if not given")
+    parser.add_argument("--key", required=False, help="TLS private key file")
+    parser.add_argument("--log", required=False, help="Log every request to this file as a JSON line")
+    args = parser.parse_args()
+
+    log_file = open(args.log, 'a', encoding='utf-8') if args.log else None
+    server = create_server(args.host, args.port,
+                           MockOME(args.devices, args.baselines, args.attributes, args.page_size),
+                           args.latency, args.jitter, args.cert, args.key, log_file)
+    print(server.server_address[1], flush=True)
+    # run_benchmark.py stops the server with terminate()
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if log_file:
+            log_file.close()
+    sys.exit(0)
@@ -0,0 +1,241 @@
+#
+# Copyright (c) 2022, Dell, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+"""
+#### Synopsis
+Measures how get_configuration_baselines.py, racadmLoop.py and scriptLoop.py scale with fleet size.
+
+#### Description
+Each script is run unmodified as a separate process against local stand-ins: mock_ome_server.py for OME and
+fake_racadm.py for racadm and the iDRAC scripts. Nothing leaves the machine, so it can run offline on a CI box.
+For every scenario and fleet size the wall time, hosts/sec, pages/sec (OME only), p50/p99 latency of the individual
+remote calls and the peak RSS of the script are reported. Latency is measured on the client side: OME requests from
+the --metrics-file of get_configuration_baselines.py and racadm calls by the racadm shim around the fake racadm
+process, so process start up and connection set up are included. Needs a POSIX system for the per-process RSS.
+
+#### Python Example
+`python run_benchmark.py --fleet-sizes 10,100,1000 --workers 16 --latency 0.05`
+`python run_benchmark.py --scenarios racadm,script --fleet-sizes 500 --json results.json`
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import RawTextHelpFormatter
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPT_DIR = os.path.dirname(BENCHMARK_DIR)
+SCENARIOS = ['ome', 'racadm', 'script']
+
+
+def percentile(values: list, percent: float):
+    """
+    Returns the nearest-rank percentile of values, or None if there are none
+    """
+
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, int(round(percent / 100.0 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def read_log(path: str) -> list:
+    entries = []
+    try:
+        with open(path, encoding='utf-8') as log_file:
+            for line in log_file:
+                line = line.strip()
+                if line:
+                    entries.append(json.loads(line))
+    except OSError:
+        pass
+    return entries
+
+
+def run_process(command: list, env: dict = None, stdin_data: str = None) -> dict:
+    """
+    Runs a command and measures it
+
+    Returns: A dictionary with the wall time in seconds, the exit code and the peak RSS of the process in MB
+    """
+
+    started = time.monotonic()
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                               env=env, cwd=SCRIPT_DIR)
+    if stdin_data:
+        process.stdin.write(stdin_data.encode('utf-8'))
+    process.stdin.close()
+    stderr = process.stderr.read().decode('utf-8', errors='replace')
+    # wait4 returns the resource usage of this process only, so the RSS of racadm children is not included
+    _, status, usage = os.wait4(process.pid, 0)
+    wall = time.monotonic() - started
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    peak_rss = usage.ru_maxrss / (1024.0 * 1024.0) if sys.platform == 'darwin' else usage.ru_maxrss / 1024.0
+    return {'wall': wall, 'returncode': process.returncode, 'peak_rss_mb': peak_rss, 'stderr': stderr[-2000:]}
+
+
+def write_hosts_file(directory: str, fleet_size: int) -> str:
+    hosts_file = os.path.join(directory, 'hosts.txt')
+    with open(hosts_file, 'w') as hosts:
+        for host in range(fleet_size):
+            hosts.write("10.%d.%d.%d\n" % (host // 65536 % 256, host // 256 % 256, host % 256))
+    return hosts_file
+
+
+def write_racadm_shim(directory: str) -> str:
+    """
+    Puts an executable named racadm in directory that runs fake_racadm.py, so racadmLoop.py finds it on PATH. The
+    shim times each call from the caller's point of view and appends it to the file in BENCHMARK_CALL_LOG.
+    """
+
+    shim = os.path.join(directory, 'racadm')
+    with open(shim, 'w') as shim_file:
+        shim_file.write("""#!%s
+import json, os, subprocess, sys, time
+started = time.monotonic()
+returncode = subprocess.call([sys.executable, %r] + sys.argv[1:])
+with open(os.environ['BENCHMARK_CALL_LOG'], 'a') as log_file:
+    log_file.write(json.dumps({'duration': time.monotonic() - started, 'returncode': returncode}) + '\\n')
+sys.exit(returncode)
+""" % (sys.executable, os.path.join(BENCHMARK_DIR, 'fake_racadm.py')))
+    os.chmod(shim, 0o755)
+    return shim
+
+
+def fake_racadm_env(args, log_file: str, path: str = None) -> dict:
+    env = dict(os.environ)
+    env['FAKE_RACADM_LATENCY'] = str(args.latency)
+    env['FAKE_RACADM_JITTER'] = str(args.jitter)
+    env['FAKE_RACADM_FAILURE'] = str(args.failure_rate)
+    env['BENCHMARK_CALL_LOG'] = log_file
+    if path:
+        env['PATH'] = path + os.pathsep + env.get('PATH', '')
+    return env
+
+
+def summarise(scenario: str, fleet_size: int, run: dict, latencies: list, pages: int = None) -> dict:
+    result = {'scenario': scenario,
+              'fleet_size': fleet_size,
+              'returncode': run['returncode'],
+              'wall_seconds': round(run['wall'], 3),
+              'hosts_per_second': round(fleet_size / run['wall'], 2) if run['wall'] else None,
+              'pages_per_second': round(pages / run['wall'], 2) if pages is not None and run['wall'] else None,
+              'requests': len(latencies),
+              'p50_ms': round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+              'p99_ms': round(percentile(latencies, 99) * 1000, 1) if latencies else None,
+              'peak_rss_mb': round(run['peak_rss_mb'], 1)}
+    if run['returncode'] != 0:
+        result['error'] = run['stderr'].strip().splitlines()[-1] if run['stderr'].strip() else 'exit code %d' \
+                                                                                               % run['returncode']
+    return result
+
+
+def benchmark_ome(args, fleet_size: int, directory: str) -> dict:
+    metrics_file = os.path.join(directory, 'ome_metrics.jsonl')
+    server = subprocess.Popen([sys.executable, os.path.join(BENCHMARK_DIR, 'mock_ome_server.py'),
+                               '--devices', str(fleet_size), '--page-size', str(args.page_size),
+                               '--latency', str(args.latency), '--jitter', str(args.jitter)],
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        port = int(server.stdout.readline().decode().strip())
+        command = [sys.executable, os.path.join(SCRIPT_DIR, 'get_configuration_baselines.py'),
+                   '--ip', '127.0.0.1:%d' % port, '--user', 'admin', '--password', 'admin',
+                   '--baseline', 'Baseline1', '--get-baseline-detail-report', '--output', 'ndjson',
+                   '--pool-size', str(args.workers), '--page-workers', str(args.workers),
+                   '--detail-workers', str(args.workers), '--metrics-file', metrics_file]
+        run = run_process(command)
+    finally:
+        server.terminate()
+        server.wait()
+    requests_made = [event for event in read_log(metrics_file)
+                     if event['kind'] == 'ome_request' and event['method'] == 'GET' and not event.get('cached')]
+    pages = sum(1 for event in requests_made if event.get('page'))
+    return summarise('ome', fleet_size, run, [event['duration'] for event in requests_made], pages)
+
+
+def benchmark_racadm(args, fleet_size: int, directory: str) -> dict:
+    log_file = os.path.join(directory, 'racadm.log')
+    write_racadm_shim(directory)
+    command = [sys.executable, os.path.join(SCRIPT_DIR, 'racadmLoop.py'),
+               '--command', 'get iDRAC.NIC.DNSRacName', '--user', 'root', '--password', 'calvin',
+               '--file', write_hosts_file(directory, fleet_size), '--workers', str(args.workers), '--no-probe']
+    run = run_process(command, fake_racadm_env(args, log_file, directory))
+    return summarise('racadm', fleet_size, run, [entry['duration'] for entry in read_log(log_file)])
+
+
+def benchmark_script(args, fleet_size: int, directory: str) -> dict:
+    log_file = os.path.join(directory, 'script.log')
+    child = '"%s" -r {ip} -u {user} -p {password} get iDRAC.NIC.DNSRacName' % write_racadm_shim(directory)
+    command = [sys.executable, os.path.join(SCRIPT_DIR, 'scriptLoop.py'), '-u', 'root', '-p', 'calvin',
+               '--file', write_hosts_file(directory, fleet_size), '--workers', str(args.workers), '--no-probe',
+               '--command', child]
+    run = run_process(command, fake_racadm_env(args, log_file))
+    return summarise('script', fleet_size, run, [entry['duration'] for entry in read_log(log_file)])
+
+
+def print_table(results: list):
+    columns = ['scenario', 'fleet_size', 'wall_seconds', 'hosts_per_second', 'pages_per_second', 'p50_ms', 'p99_ms',
+               'peak_rss_mb', 'returncode']
+    widths = [max(len(column), *(len(str(result.get(column))) for result in results)) for column in columns]
+    print('  '.join(column.ljust(width) for column, width in zip(columns, widths)))
+    for result in results:
+        print('  '.join(str(result.get(column, '')).ljust(width) for column, width in zip(columns, widths)))
+    for result in results:
+        if 'error' in result:
+            print("%s with %d hosts failed: %s" % (result['scenario'], result['fleet_size'], result['error']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
+    parser.add_argument("--scenarios", required=False, default=','.join(SCENARIOS),
+                        help="Comma separated scenarios to run: %s" % ', '.join(SCENARIOS))
+    parser.add_argument("--fleet-sizes", required=False, default='10,100,1000',
+                        help="Comma separated number of hosts to benchmark with")
+    parser.add_argument("--workers", required=False, type=int, default=16,
+                        help="Workers passed to each script")
+    parser.add_argument("--latency", required=False, type=float, default=0.05,
+                        help="Seconds each simulated OME request or racadm command takes")
+    parser.add_argument("--jitter", required=False, type=float, default=0.0,
+                        help="Up to this many extra seconds are randomly added to each simulated call")
+    parser.add_argument("--failure-rate", required=False, type=float, default=0.0,
+                        help="Fraction of racadm commands that fail")
+    parser.add_argument("--page-size", required=False, type=int, default=50,
+                        help="Page size of the mock OME server")
+    parser.add_argument("--json", required=False, help="Also write the results to this file as JSON")
+    args = parser.parse_args()
+
+    scenarios = [scenario.strip() for scenario in args.scenarios.split(',') if scenario.strip()]
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            parser.error("Unknown scenario %s. Choose from %s" % (scenario, ', '.join(SCENARIOS)))
+    fleet_sizes = [int(size) for size in args.fleet_sizes.split(',') if size.strip()]
+
+    benchmarks = {'ome': benchmark_ome, 'racadm': benchmark_racadm, 'script': benchmark_script}
+    results = []
+    for scenario in scenarios:
+        for fleet_size in fleet_sizes:
+            directory = tempfile.mkdtemp(prefix='dell_scripts_benchmark_')
+            try:
+                results.append(benchmarks[scenario](args, fleet_size, directory))
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+    sys.exit(1 if any(result['returncode'] != 0 for result in results) else 0)
@@ -0,0 +1,123 @@
+#
+# Copyright (c) 2022, Dell, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+"""
+#### Synopsis
+Checkpoint journal shared by racadmLoop.py and scriptLoop.py so an interrupted fleet run can be resumed.
+
+#### Description
+Every host is appended to the journal as a JSON line the moment it finishes, with whether it succeeded. The file is
+flushed and synced after each line so nothing already finished is lost if the run is killed. Entries are tagged with
+a signature of the command being run. A journal written for a different command is ignored, so a host is never
+skipped because it completed some other work.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class Checkpoint:
+    """
+    Append-only journal of the hosts a fleet run has finished
+
+    Args:
+        path: The journal file. It is created if it does not exist
+        signature: Text identifying the work being done, for example the command. Only entries with the same
+            signature are used by completed() and select()
+    """
+
+    def __init__(self, path: str, signature: str = ''):
+        self.path = path
+        self.signature = hashlib.sha256(signature.encode('utf-8')).hexdigest()[:16]
+        self.lock = threading.Lock()
+        self.journal = None
+
+    def completed(self) -> dict:
+        """
+        Returns: A dictionary of host to the last journal entry recorded for it
+        """
+
+        entries = {}
+        try:
+            with open(self.path, encoding='utf-8') as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # The last line may be partial if the previous run was killed while writing it
+                        continue
+                    if entry.get('signature') == self.signature:
+                        entries[entry['host']] = entry
+        except OSError:
+            pass
+        return entries
+
+    def select(self, hosts: list, resume: bool = False, retry_failed: bool = False) -> list:
+        """
+        Chooses which hosts to run
+
+        Args:
+            hosts: Every host in the input file, in order
+            resume: Skip hosts that already succeeded
+            retry_failed: Only run hosts whose last attempt failed
+
+        Returns: The hosts to run, in the order given
+        """
+
+        if not resume and not retry_failed:
+            return list(hosts)
+        entries = self.completed()
+        if retry_failed:
+            return [host for host in hosts if host in entries and not entries[host]['ok']]
+        return [host for host in hosts if not (host in entries and entries[host]['ok'])]
+
+    def record(self, host: str, ok: bool, **fields):
+        """
+        Appends a finished host to the journal
+
+        Args:
+            host: The host that finished
+            ok: Whether it succeeded
+            fields: Any other values to keep, such as the exit code
+        """
+
+        entry = {'host': host, 'ok': ok, 'time': time.time(), 'signature': self.signature}
+        entry.update(fields)
+        with self.lock:
+            if self.journal is None:
+                partial = self._ends_partial()
+                self.journal = open(self.path, 'a', encoding='utf-8')
+                if partial:
+                    # Start on a new line so the first entry of this run is not joined onto the fragment and lost
+                    self.journal.write('\n')
+            self.journal.write(json.dumps(entry) + '\n')
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+
+    def _ends_partial(self) -> bool:
+        # A run killed while writing leaves a last line without its newline
+        try:
+            with open(self.path, 'rb') as journal:
+                journal.seek(0, os.SEEK_END)
+                if journal.tell() == 0:
+                    return False
+                journal.seek(-1, os.SEEK_END)
+                return journal.read(1) != b'\n'
+        except OSError:
+            return False
+
+    def close(self):
+        with self.lock:
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
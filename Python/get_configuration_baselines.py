@@ -30,9 +30,17 @@ Authentication. Note: The credentials entered are not stored to disk.
 """
 
 import argparse
+import atexit
+import hashlib
+import itertools
 import json
+import tempfile
+import threading
+import time
 import sys, os
 from argparse import RawTextHelpFormatter
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from getpass import getpass
 from pprint import pprint
 from urllib.parse import urlparse
@@ -40,15 +48,352 @@ import http
 import logging
 import requests
 import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from metrics import Metrics, FORMATS as METRICS_FORMATS, endpoint
 
-http.client.HTTPConnection.debuglevel = 1
-logging.basicConfig()
-logging.getLogger().setLevel(logging.DEBUG)
-requests_log = logging.getLogger("requests.packages.urllib3")
-requests_log.setLevel(logging.DEBUG)
-requests_log.propagate = True
 
-def authenticate(ome_ip_address: str, ome_username: str, ome_password: str) -> dict:
+def enable_debug_logging():
+    """
+    Logs every HTTP request and response on the wire. Turned on with --debug.
+    """
+
+    http.client.HTTPConnection.debuglevel = 1
+    logging.basicConfig()
+    logging.getLogger().setLevel(logging.DEBUG)
+    requests_log = logging.getLogger("requests.packages.urllib3")
+    requests_log.setLevel(logging.DEBUG)
+    requests_log.propagate = True
+
+
+# Connect and TLS handshake times of the last connection opened by the current thread. Filled in by the Timed*
+# connection classes and read back by OMEClient.request after each request.
+connection_timings = threading.local()
+
+
+class TimedHTTPConnection(urllib3.connection.HTTPConnection):
+    def _new_conn(self):
+        started = time.monotonic()
+        conn = super()._new_conn()
+        # urllib3 resolves the name and opens the socket in one call so this includes the DNS lookup
+        connection_timings.connect = time.monotonic() - started
+        return conn
+
+
+class TimedHTTPSConnection(urllib3.connection.HTTPSConnection):
+    def _new_conn(self):
+        started = time.monotonic()
+        conn = super()._new_conn()
+        connection_timings.connect = time.monotonic() - started
+        return conn
+
+    def connect(self):
+        started = time.monotonic()
+        super().connect()
+        connection_timings.tls = time.monotonic() - started - (getattr(connection_timings, 'connect', None) or 0)
+
+
+class TimedHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose connections record how long connecting and the TLS handshake took
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': TimedHTTPConnectionPool,
+                                                   'https': TimedHTTPSConnectionPool}
+
+
+class ResponseCache:
+    """
+    On-disk cache of successful GET responses from OME, keyed by the full request URL including any $filter, $top
+    and $skip options. Entries younger than ttl are returned without contacting OME. Older entries are revalidated
+    with If-None-Match/If-Modified-Since when OME returned an ETag or Last-Modified header, and reused if OME answers
+    304 Not Modified. When the cache grows past max_size bytes the least recently used entries are removed.
+
+    Args:
+        cache_dir: Directory the cache is stored in. It is created readable only by the current user
+        ttl: Number of seconds an entry is used without revalidation
+        max_size: Maximum total size of the cache in bytes
+    """
+
+    def __init__(self, cache_dir: str, ttl: int = 300, max_size: int = 100 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_size = max_size
+        # Running total of the cache size so the directory is only listed when it has grown past max_size
+        self.size = None
+        self.size_lock = threading.Lock()
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json')
+
+    def load(self, url: str):
+        try:
+            with open(self._path(url), encoding='utf-8') as cache_file:
+                entry = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+        # A hash collision is next to impossible but a mismatched entry must never be returned
+        if entry.get('url') != url:
+            return None
+        return entry
+
+    def is_fresh(self, entry: dict) -> bool:
+        return time.time() - entry['stored'] < self.ttl
+
+    @staticmethod
+    def validators(entry: dict) -> dict:
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def _write(self, url: str, entry: dict):
+        # Write to a temporary file and rename it so concurrent readers never see a partial entry
+        path = self._path(url)
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as cache_file:
+                json.dump(entry, cache_file)
+            new_size = os.path.getsize(temp_path)
+            try:
+                old_size = os.path.getsize(path)
+            except OSError:
+                old_size = 0
+            os.replace(temp_path, path)
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return
+        with self.size_lock:
+            if self.size is not None:
+                self.size += new_size - old_size
+        if self.size is None or self.size > self.max_size:
+            self.evict()
+
+    def store(self, url: str, response: requests.Response):
+        entry = {'url': url,
+                 'stored': time.time(),
+                 'etag': response.headers.get('ETag'),
+                 'last_modified': response.headers.get('Last-Modified'),
+                 'content_type': response.headers.get('Content-Type'),
+                 'body': response.text}
+        self._write(url, entry)
+
+    def touch(self, url: str):
+        # Entries are ordered by mtime for eviction, so a hit marks the entry as recently used
+        try:
+            os.utime(self._path(url))
+        except OSError:
+            pass
+
+    def refresh(self, url: str, entry: dict):
+        # OME confirmed the entry is unchanged, restart its TTL
+        entry['stored'] = time.time()
+        self._write(url, entry)
+
+    @staticmethod
+    def to_response(entry: dict) -> requests.Response:
+        response = requests.Response()
+        response.status_code = 200
+        response.url = entry['url']
+        response.encoding = 'utf-8'
+        response._content = entry['body'].encode('utf-8')
+        if entry.get('content_type'):
+            response.headers['Content-Type'] = entry['content_type']
+        if entry.get('etag'):
+            response.headers['ETag'] = entry['etag']
+        return response
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache is no larger than 90% of max_size, so the next few
+        writes do not each have to evict again. The directory is listed to get the real total, which also corrects the
+        running total for entries written by other processes.
+        """
+
+        with self.size_lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+            # Entries are rewritten when they are stored or revalidated and touched on every hit, so mtime is the last
+            # time they were used
+            target = self.max_size if total <= self.max_size else self.max_size * 0.9
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+            self.size = total
+
+
+class OMEClient:
+    """
+    Shared HTTP client used for every call to OME. A single pooled requests.Session is kept open so connections and
+    TLS sessions are reused across pages and reports instead of performing a new handshake for every request.
+
+    Args:
+        pool_size: The maximum number of connections kept open to each OME appliance
+        retries: The number of times to retry a request which failed with HTTP 429 or a 5xx error
+        backoff_factor: Backoff factor applied between retries. See urllib3.util.retry.Retry
+        keep_alive: Set to False to close the connection after each request
+        verify: Whether to verify the OME TLS certificate
+        cache: An optional ResponseCache used for GET requests
+        auth: An optional OMESession used to log in again when OME rejects an expired X-Auth-Token with HTTP 401.
+            When several appliances are used, appliance_auth maps each appliance address to its own OMESession
+        metrics: An optional Metrics every request is recorded in, with its connect, TLS and time to first byte
+    """
+
+    def __init__(self, pool_size: int = 10, retries: int = 3, backoff_factor: float = 0.5, keep_alive: bool = True,
+                 verify: bool = False, cache: ResponseCache = None, metrics: Metrics = None):
+        self.verify = verify
+        self.cache = cache
+        self.metrics = metrics
+        self.auth = None
+        self.appliance_auth = {}
+        self.session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=[429, 500, 502, 503, 504],
+                      respect_retry_after_header=True, raise_on_status=False)
+        adapter_class = TimedHTTPAdapter if metrics is not None else HTTPAdapter
+        adapter = adapter_class(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        if not keep_alive:
+            self.session.headers['Connection'] = 'close'
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        # verify is passed on every request because Session.verify is overridden by REQUESTS_CA_BUNDLE
+        kwargs.setdefault('verify', self.verify)
+        response = self._send(method, url, **kwargs)
+        headers = kwargs.get('headers')
+        auth = self.appliance_auth.get(urlparse(url).netloc, self.auth)
+        if response.status_code == 401 and auth is not None and headers and 'X-Auth-Token' in headers:
+            # The token expired or the session was deleted on OME. Log in again and retry the request once.
+            auth.reauthenticate(headers['X-Auth-Token'])
+            headers['X-Auth-Token'] = auth.headers['X-Auth-Token']
+            response = self._send(method, url, reauthenticated=True, **kwargs)
+        return response
+
+    def _send(self, method: str, url: str, reauthenticated: bool = False, **kwargs) -> requests.Response:
+        if self.metrics is None:
+            return self.session.request(method, url, **kwargs)
+
+        connection_timings.connect = None
+        connection_timings.tls = None
+        started = time.monotonic()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException as err:
+            self.metrics.record('ome_request', endpoint(url), time.monotonic() - started, None, method=method,
+                                appliance=urlparse(url).netloc, error=str(err))
+            raise
+        duration = time.monotonic() - started
+        connect = connection_timings.connect
+        tls = connection_timings.tls
+        # elapsed runs from sending the request until the headers are parsed, including any new connection
+        ttfb = max(response.elapsed.total_seconds() - (connect or 0) - (tls or 0), 0)
+        retry_history = getattr(getattr(response.raw, 'retries', None), 'history', None) or ()
+        self.metrics.record('ome_request', endpoint(url), duration, response.status_code, method=method,
+                            appliance=urlparse(url).netloc, connect=connect, tls=tls, ttfb=ttfb,
+                            bytes=len(response.content), retries=len(retry_history) + (1 if reauthenticated else 0),
+                            page=method == 'GET' and b'"@odata.count"' in response.content)
+        return response
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        if self.cache is None:
+            return self.request('GET', url, **kwargs)
+
+        entry = self.cache.load(url)
+        if entry is not None and self.cache.is_fresh(entry):
+            if self.metrics is not None:
+                self.metrics.record('ome_request', endpoint(url), 0.0, 200, method='GET', appliance=urlparse(url).netloc,
+                                    cached=True, page='"@odata.count"' in entry['body'])
+            self.cache.touch(url)
+            return self.cache.to_response(entry)
+
+        headers = dict(kwargs.pop('headers', None) or {})
+        if entry is not None:
+            headers.update(self.cache.validators(entry))
+        response = self.request('GET', url, headers=headers, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            self.cache.refresh(url, entry)
+            return self.cache.to_response(entry)
+        if response.status_code == 200:
+            self.cache.store(url, response)
+        return response
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> requests.Response:
+        return self.request('DELETE', url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+class OMERequestError(Exception):
+    """
+    Raised when OME answers a request for data with anything other than HTTP 200
+
+    Args:
+        message: Description of the failure
+        response: The response OME returned
+    """
+
+    def __init__(self, message: str, response: requests.Response):
+        super().__init__(message)
+        self.status_code = response.status_code
+        self.text = response.text
+
+    @property
+    def error(self):
+        """
+        The error object from the body of the response, or the body itself if it is not an OME error
+        """
+
+        try:
+            return json.loads(self.text)['error']
+        except (ValueError, KeyError, TypeError):
+            return self.text
+
+
+# Client used by every function in this module. Replace it to change pool size or retry behaviour.
+client = OMEClient()
+
+# Page size ($top) and number of concurrent page requests used by get_data when the caller does not pass them.
+# Leaving default_page_workers as None keeps the original behaviour of following @odata.nextLink one page at a time.
+default_page_size = None
+default_page_workers = None
+
+
+def create_session(ome_ip_address: str, ome_username: str, ome_password: str) -> tuple:
     """
     Authenticates with OME and creates a session
 
@@ -57,7 +402,7 @@ def authenticate(ome_ip_address: str, ome_username: str, ome_password: str) -> d
         ome_username:  Username for OME
         ome_password: OME password
 
-    Returns: A dictionary of HTTP headers
+    Returns: A tuple of a dictionary of HTTP headers and the Id of the session on OME
 
     Raises:
         Exception: A generic exception in the event of a failure to connect.
@@ -69,24 +414,364 @@ def authenticate(ome_ip_address: str, ome_username: str, ome_password: str) -> d
                     'Password': ome_password,
                     'SessionType': 'API'}
     try:
-        session_info = requests.post(session_url, verify=False,
-                                     data=json.dumps(user_details),
-                                     headers=authenticated_headers)
+        session_info = client.post(session_url,
+                                   data=json.dumps(user_details),
+                                   headers=authenticated_headers)
     except requests.exceptions.ConnectionError:
-        print("Failed to connect to OME. This typically indicates a network connectivity problem. Can you ping OME?")
+        print("Failed to connect to OME. This typically indicates a network connectivity problem. Can you ping OME?",
+              file=sys.stderr)
         sys.exit(0)
 
     if session_info.status_code == 201:
         authenticated_headers['X-Auth-Token'] = session_info.headers['X-Auth-Token']
-        return authenticated_headers
+        try:
+            session_id = session_info.json().get('Id')
+        except ValueError:
+            session_id = None
+        return authenticated_headers, session_id
     else:
         print("There was a problem authenticating with OME. Are you sure you have the right username, password, "
-              "and IP?")
+              "and IP?", file=sys.stderr)
         raise Exception("There was a problem authenticating with OME. Are you sure you have the right username, "
                         "password, and IP?")
 
 
-def get_data(authenticated_headers: dict, url: str, odata_filter: str = None, max_pages: int = None) -> dict:
+def authenticate(ome_ip_address: str, ome_username: str, ome_password: str) -> dict:
+    """
+    Authenticates with OME and creates a session
+
+    Args:
+        ome_ip_address: IP address of the OME server
+        ome_username:  Username for OME
+        ome_password: OME password
+
+    Returns: A dictionary of HTTP headers
+
+    Raises:
+        Exception: A generic exception in the event of a failure to connect.
+    """
+
+    return create_session(ome_ip_address, ome_username, ome_password)[0]
+
+
+class OMESession:
+    """
+    Manages the OME session used by this module. The X-Auth-Token can be saved to token_file, readable only by the
+    current user, so the next invocation reuses it instead of logging in again. When OME rejects the token with
+    HTTP 401 the client calls reauthenticate() and the request is retried with a new token.
+
+    Args:
+        ome_ip_address: IP address of the OME server
+        ome_username: Username for OME
+        ome_password: OME password, or a function returning it. A function is only called if a login is needed
+        token_file: Optional path the session token is saved to and loaded from
+    """
+
+    def __init__(self, ome_ip_address: str, ome_username: str, ome_password, token_file: str = None):
+        self.ome_ip_address = ome_ip_address
+        self.ome_username = ome_username
+        self.ome_password = ome_password
+        self.token_file = token_file
+        self.session_id = None
+        self.headers = None
+        self.lock = threading.Lock()
+
+    def _password(self) -> str:
+        if callable(self.ome_password):
+            self.ome_password = self.ome_password()
+        return self.ome_password
+
+    def _load(self) -> bool:
+        if not self.token_file:
+            return False
+        try:
+            with open(self.token_file, encoding='utf-8') as token_file:
+                saved = json.load(token_file)
+        except (OSError, ValueError):
+            return False
+        if saved.get('ip') != self.ome_ip_address or saved.get('username') != self.ome_username \
+                or not saved.get('token'):
+            return False
+        self.headers = {'content-type': 'application/json', 'X-Auth-Token': saved['token']}
+        self.session_id = saved.get('session_id')
+        return True
+
+    def _save(self):
+        if not self.token_file:
+            return
+        # Created with 0600 permissions so other users on the host cannot read the token
+        fd = os.open(self.token_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as token_file:
+            json.dump({'ip': self.ome_ip_address,
+                       'username': self.ome_username,
+                       'token': self.headers['X-Auth-Token'],
+                       'session_id': self.session_id}, token_file)
+
+    def _remove_token_file(self):
+        if self.token_file:
+            try:
+                os.remove(self.token_file)
+            except OSError:
+                pass
+
+    def login(self) -> dict:
+        """
+        Returns headers for the saved session if there is one, otherwise creates a new session
+
+        Returns: A dictionary of HTTP headers
+        """
+
+        with self.lock:
+            if self.headers is None and not self._load():
+                self.headers, self.session_id = create_session(self.ome_ip_address, self.ome_username,
+                                                               self._password())
+                self._save()
+            return self.headers
+
+    def reauthenticate(self, rejected_token: str = None):
+        """
+        Creates a new session after OME rejected the current token. If another thread has already replaced
+        rejected_token nothing is done.
+
+        Args:
+            rejected_token: The X-Auth-Token that OME rejected
+        """
+
+        with self.lock:
+            if self.headers is not None and rejected_token is not None \
+                    and self.headers['X-Auth-Token'] != rejected_token:
+                return
+            new_headers, self.session_id = create_session(self.ome_ip_address, self.ome_username, self._password())
+            if self.headers is None:
+                self.headers = new_headers
+            else:
+                # Update in place so callers holding the headers dictionary pick up the new token
+                self.headers.update(new_headers)
+            self._save()
+
+    def logout(self):
+        """
+        Deletes the session on OME and removes the saved token
+        """
+
+        with self.lock:
+            if self.headers is None:
+                self._load()
+            if self.headers is not None and self.session_id is not None:
+                try:
+                    client.delete("https://%s/api/SessionService/Sessions('%s')"
+                                  % (self.ome_ip_address, self.session_id), headers=dict(self.headers))
+                except requests.exceptions.RequestException:
+                    pass
+            self.headers = None
+            self.session_id = None
+            self._remove_token_file()
+
+    def close(self):
+        """
+        Called on shutdown. A session saved to token_file is kept for the next invocation, otherwise it is deleted
+        so sessions do not pile up on OME.
+        """
+
+        if not self.token_file:
+            self.logout()
+
+
+def build_query_url(url: str, odata_filter: str = None, top: int = None, skip: int = None, select: list = None) -> str:
+    """
+    Appends the OData query options used by get_data to a URL
+
+    Args:
+        url: The API url against which you would like to make a request
+        odata_filter: An optional odata filter to run against the API endpoint
+        top: The number of results to return in the page ($top)
+        skip: The number of results to skip before the page starts ($skip)
+        select: The properties to return for each result ($select)
+
+    Returns: The URL with the query options appended
+    """
+
+    query = []
+    if select:
+        query.append('$select=' + ','.join(select))
+    if odata_filter:
+        query.append('$filter=' + odata_filter)
+    if top:
+        query.append('$top=%d' % top)
+    if skip:
+        query.append('$skip=%d' % skip)
+    if not query:
+        return url
+    return url + ('&' if '?' in url else '?') + '&'.join(query)
+
+
+def get_page(authenticated_headers: dict, url: str) -> list:
+    """
+    Retrieves a single page of results from OME
+
+    Args:
+        authenticated_headers: A dictionary of HTTP headers generated from an authenticated session with OME
+        url: The full URL of the page, including any $skip/$top options
+
+    Returns: The list of results in the page
+
+    Raises:
+        OMERequestError: If OME returns anything other than HTTP 200
+    """
+
+    response = client.get(url, headers=authenticated_headers)
+    if response.status_code != 200:
+        print("Unknown error occurred. Received HTTP response code: " + str(response.status_code) +
+              " with error: " + response.text, file=sys.stderr)
+        raise OMERequestError("Unknown error occurred. Received HTTP response code: " + str(response.status_code)
+                              + " with error: " + response.text, response)
+    requested_data = response.json()
+    if 'value' in requested_data:
+        return requested_data['value']
+    return requested_data
+
+
+def iter_remaining_pages(authenticated_headers: dict, url: str, first_page: dict, odata_filter: str = None,
+                         max_pages: int = None, page_size: int = None, page_workers: int = 4):
+    """
+    Uses @odata.count from the first page to work out the $skip offset of every remaining page and fetches them
+    concurrently. Pages are yielded in order as soon as each one and the pages before it have arrived.
+
+    Args:
+        authenticated_headers: A dictionary of HTTP headers generated from an authenticated session with OME
+        url: The API url against which you would like to make a request
+        first_page: The decoded JSON of the first page
+        odata_filter: An optional parameter for providing an odata filter to run against the API endpoint.
+        max_pages: The maximum number of pages you would like to return, including the first page
+        page_size: The number of results per page. Defaults to the size of the first page
+        page_workers: The maximum number of pages fetched at the same time
+
+    Yields: The list of results in each page after the first
+    """
+
+    total = first_page['@odata.count']
+    first_size = len(first_page['value'])
+    # An appliance that caps $top returns fewer results than asked for, so the first page sets the stride
+    page_size = min(page_size, first_size) if page_size else first_size
+    if page_size <= 0:
+        return
+
+    offsets = list(range(first_size, total, page_size))
+    if max_pages:
+        offsets = offsets[:max(max_pages - 1, 0)]
+    if not offsets:
+        return
+
+    def fetch(offset):
+        # A short page would leave a gap before the next offset, so the rest of it is requested until it is full
+        expected = min(page_size, total - offset)
+        page = get_page(authenticated_headers, build_query_url(url, odata_filter, page_size, offset))
+        while len(page) < expected:
+            remainder = get_page(authenticated_headers, build_query_url(url, odata_filter, expected - len(page),
+                                                                        offset + len(page)))
+            if not remainder:
+                raise Exception("Expected %d results at $skip=%d from %s but received %d"
+                                % (expected, offset, url, len(page)))
+            page += remainder
+        return page[:expected]
+
+    with ThreadPoolExecutor(max_workers=max(1, min(page_workers, len(offsets)))) as executor:
+        # map() yields results in submission order so pages are reassembled in the order OME returns them
+        yield from executor.map(fetch, offsets)
+
+
+def iter_pages(authenticated_headers: dict, url: str, odata_filter: str = None, max_pages: int = None,
+               page_size: int = None, page_workers: int = None, select: list = None):
+    """
+    Retrieves a collection from OME page by page. This is the pagination and error handling shared by get_data and
+    iter_data.
+
+    Args:
+        authenticated_headers: A dictionary of HTTP headers generated from an authenticated session with OME
+        url: The API url against which you would like to make a request
+        odata_filter: An optional parameter for providing an odata filter to run against the API endpoint.
+        max_pages: The maximum number of pages you would like to return
+        page_size: An optional number of results to request per page ($top)
+        page_workers: If set, pages after the first are fetched concurrently. See get_data
+        select: An optional list of the properties OME should return for each record ($select)
+
+    Yields: The decoded JSON of the first page, then the list of results in each page after it. If the URL is not a
+        collection only the resource itself is yielded
+
+    Raises:
+        OMERequestError: If OME returns anything other than HTTP 200 for any page
+    """
+
+    url = build_query_url(url, select=select)
+    if page_size is None:
+        page_size = default_page_size
+    if page_workers is None:
+        page_workers = default_page_workers
+
+    response = client.get(build_query_url(url, odata_filter, page_size), headers=authenticated_headers)
+    if response.status_code != 200:
+        raise OMERequestError("Received HTTP response code: " + str(response.status_code) + " while retrieving data "
+                              "from " + build_query_url(url, odata_filter) + " with error: " + response.text, response)
+    requested_data = response.json()
+    yield requested_data
+    if 'value' not in requested_data:
+        return
+
+    if page_workers and '@odata.nextLink' in requested_data and '@odata.count' in requested_data:
+        yield from iter_remaining_pages(authenticated_headers, url, requested_data, odata_filter, max_pages,
+                                        page_size, page_workers)
+        return
+
+    i = 1
+    while '@odata.nextLink' in requested_data:
+        # Stop if we have reached the maximum number of pages to be returned
+        if max_pages and i >= max_pages:
+            break
+        i = i + 1
+        # The @odata.nextLink key is only present in data if there are additional pages
+        next_link_url = '{uri.scheme}://{uri.netloc}'.format(uri=urlparse(url)) + requested_data['@odata.nextLink']
+        response = client.get(next_link_url, headers=authenticated_headers)
+        if response.status_code != 200:
+            raise OMERequestError("Unknown error occurred. Received HTTP response code: " + str(response.status_code)
+                                  + " with error: " + response.text, response)
+        requested_data = response.json()
+        yield requested_data.get('value', [])
+
+
+def iter_data(authenticated_headers: dict, url: str, odata_filter: str = None, max_pages: int = None,
+              page_size: int = None, page_workers: int = None, select: list = None):
+    """
+    Generator version of get_data. Records are yielded one at a time as each page arrives so a large collection
+    never has to be held in memory at once and the caller can start working before the last page is retrieved.
+
+    Args:
+        authenticated_headers: A dictionary of HTTP headers generated from an authenticated session with OME
+        url: The API url against which you would like to make a request
+        odata_filter: An optional parameter for providing an odata filter to run against the API endpoint.
+        max_pages: The maximum number of pages you would like to return
+        page_size: An optional number of results to request per page ($top)
+        page_workers: If set, pages after the first are fetched concurrently. See get_data
+        select: An optional list of the properties OME should return for each record ($select)
+
+    Yields: Each record in the collection, in order
+
+    Raises:
+        OMERequestError: If OME returns an error for any page
+    """
+
+    pages = iter_pages(authenticated_headers, url, odata_filter, max_pages, page_size, page_workers, select)
+    first_page = next(pages)
+    if 'value' not in first_page:
+        # Not a collection, return the resource itself
+        yield first_page
+        return
+    yield from first_page['value']
+    for page in pages:
+        yield from page
+
+
+def get_data(authenticated_headers: dict, url: str, odata_filter: str = None, max_pages: int = None,
+             page_size: int = None, page_workers: int = None, select: list = None) -> dict:
     """
     This function retrieves data from a specified URL. Get requests from OME return paginated data. The code below
     handles pagination. This is the equivalent in the UI of a list of results that require you to go to different
@@ -97,110 +782,149 @@ def get_data(authenticated_headers: dict, url: str, odata_filter: str = None, ma
         url: The API url against which you would like to make a request
         odata_filter: An optional parameter for providing an odata filter to run against the API endpoint.
         max_pages: The maximum number of pages you would like to return
+        page_size: An optional number of results to request per page ($top)
+        page_workers: If set, the pages after the first are fetched concurrently using $skip/$top with up to this
+            many requests in flight instead of following @odata.nextLink one page at a time
+        select: An optional list of the properties OME should return for each record ($select)
 
     Returns: Returns a dictionary of data received from OME
 
+    Raises:
+        OMERequestError: If OME returns an error, other than OME rejecting odata_filter
     """
 
-    next_link_url = None
+    pages = iter_pages(authenticated_headers, url, odata_filter, max_pages, page_size, page_workers, select)
+    try:
+        first_page = next(pages)
+    except OMERequestError as err:
+        if odata_filter and err.status_code == 400:
+            print("Received an error while retrieving data from %s:" % build_query_url(url, odata_filter,
+                                                                                     select=select), file=sys.stderr)
+            pprint(err.error, stream=sys.stderr)
+            return {}
+        raise
 
-    if odata_filter:
-        count_data = requests.get(url + '?$filter=' + odata_filter, headers=authenticated_headers, verify=False)
+    if 'value' not in first_page:
+        return first_page
+    if odata_filter and first_page.get('@odata.count', 0) <= 0:
+        print("No results found!", file=sys.stderr)
+        return {}
 
-        if count_data.status_code == 400:
-            print("Received an error while retrieving data from %s:" % url + '?$filter=' + odata_filter)
-            pprint(count_data.json()['error'])
-            return {}
+    data = list(first_page['value'])
+    for page in pages:
+        data += page
+    return data
 
-        count_data = count_data.json()
-        if count_data['@odata.count'] <= 0:
-            print("No results found!")
-            return {}
-    else:
-        count_data = requests.get(url, headers=authenticated_headers, verify=False).json()
+def odata_string(value: str) -> str:
+    """
+    Quotes a value for use in an OData $filter. Single quotes are escaped by doubling them.
+    """
 
-    if 'value' in count_data:
-        data = count_data['value']
-    else:
-        data = count_data
+    return "'%s'" % value.replace("'", "''")
 
-    if '@odata.nextLink' in count_data:
-        # Grab the base URI
-        next_link_url = '{uri.scheme}://{uri.netloc}'.format(uri=urlparse(url)) + count_data['@odata.nextLink']
+def get_data_pushdown(authenticated_headers: dict, url: str, odata_filter: str = None, select: list = None,
+                      client_filter=None) -> list:
+    """
+    Retrieves data with the filter and projection done by OME. If OME answers the query with any error or returns
+    nothing, the full collection is retrieved and filtered and projected here instead. The result is filtered and
+    projected locally in either case so it is the same whether or not the appliance honoured $filter and $select.
 
-    i = 1
-    while next_link_url is not None:
-        # Break if we have reached the maximum number of pages to be returned
-        if max_pages:
-            if i >= max_pages:
-                break
-            else:
-                i = i + 1
-        response = requests.get(next_link_url, headers=authenticated_headers, verify=False)
-        next_link_url = None
-        if response.status_code == 200:
-            requested_data = response.json()
-            if requested_data['@odata.count'] <= 0:
-                print("No results found!")
-                return {}
-
-            # The @odata.nextLink key is only present in data if there are additional pages. We check for it and if it
-            # is present we get a link to the page with the next set of results.
-            if '@odata.nextLink' in requested_data:
-                next_link_url = '{uri.scheme}://{uri.netloc}'.format(uri=urlparse(url)) + \
-                                requested_data['@odata.nextLink']
-
-            if 'value' in requested_data:
-                data += requested_data['value']
-            else:
-                data += requested_data
-        else:
-            print("Unknown error occurred. Received HTTP response code: " + str(response.status_code) +
-                  " with error: " + response.text)
-            raise Exception("Unknown error occurred. Received HTTP response code: " + str(response.status_code)
-                            + " with error: " + response.text)
+    Args:
+        authenticated_headers: A dictionary of HTTP headers generated from an authenticated session with OME
+        url: The API url against which you would like to make a request
+        odata_filter: An optional odata filter for OME to apply
+        select: An optional list of the properties to keep for each record
+        client_filter: A function returning True for records matching odata_filter, used for the local filtering
+
+    Returns: A list of the matching records
 
+    Raises:
+        OMERequestError: If the collection cannot be retrieved even without $filter and $select
+    """
+
+    data = []
+    if odata_filter or select:
+        try:
+            data = list(iter_data(authenticated_headers, url, odata_filter, select=select))
+        except OMERequestError as err:
+            print("OME returned HTTP %d for %s with $filter/$select." % (err.status_code, url), file=sys.stderr)
+    if not data:
+        if odata_filter or select:
+            print("Retrieving %s without $filter/$select and filtering locally." % url, file=sys.stderr)
+        data = list(iter_data(authenticated_headers, url))
+    if client_filter:
+        data = [record for record in data if client_filter(record)]
+    if select:
+        data = [{key: record[key] for key in select if key in record} for record in data]
     return data
 
+def iter_data_pushdown(authenticated_headers: dict, url: str, select: list = None):
+    """
+    Generator version of get_data_pushdown for projection. If OME rejects $select on the first page the collection
+    is streamed again without it. Records are always projected locally.
+
+    Args:
+        authenticated_headers: A dictionary of HTTP headers generated from an authenticated session with OME
+        url: The API url against which you would like to make a request
+        select: An optional list of the properties to keep for each record
+
+    Yields: Each record in the collection, in order
+    """
+
+    records = iter_data(authenticated_headers, url, select=select)
+    try:
+        first_record = next(records)
+    except StopIteration:
+        return
+    except Exception as err:
+        if not select:
+            raise
+        print("Retrieving %s without $select and projecting locally: %s" % (url, err), file=sys.stderr)
+        records = iter_data(authenticated_headers, url)
+    else:
+        records = itertools.chain([first_record], records)
+    for record in records:
+        yield {key: record[key] for key in select if key in record} if select else record
+
 def get_configuration_baselines(authenticated_headers: dict,
                            ome_ip_address: str,
-                           name: str = None
+                           name: str = None,
+                           select: list = None
                            ):
     """
-    Gets a list of configuration baselines from OME
+    Gets a list of configuration baselines from OME. The name filter and projection are done by OME when the
+    appliance supports them.
 
     Args:
         authenticated_headers: A dictionary of HTTP headers generated from an authenticated session with OME
         ome_ip_address: IP address of the OME server
         name: Baseline Name
+        select: An optional list of the properties to return for each baseline
     """
 
     configuration_baselines = \
-        get_data(authenticated_headers, "https://%s/api/TemplateService/Baselines" % ome_ip_address)  # type: dict
+        get_data_pushdown(authenticated_headers, "https://%s/api/TemplateService/Baselines" % ome_ip_address,
+                          "Name eq %s" % odata_string(name) if name else None, select,
+                          (lambda configuration_baseline: configuration_baseline.get("Name") == name) if name
+                          else None)  # type: list
 
     if not configuration_baselines:
+        if name:
+            return []
         print("Unable to retrieve configuration list from %s. This could happen for many reasons but the most likely is a"
-              " failure in the connection." % ome_ip_address)
-        exit(0)
-
-    if len(configuration_baselines) <= 0:
-        print("No configuration baselines found on this OME server: " + ome_ip_address + ". Exiting.")
+              " failure in the connection." % ome_ip_address, file=sys.stderr)
         exit(0)
 
     configuration_baseline_list = []  # type: list
-    if name:
-        for configuration_baseline in configuration_baselines:
-            if configuration_baseline["Name"] == name:
-                configuration_baseline_list.append(configuration_baseline)
-    else:
-        for configuration_baseline in configuration_baselines:
-            configuration_baseline_list.append(configuration_baseline)
+    for configuration_baseline in configuration_baselines:
+        configuration_baseline_list.append(configuration_baseline)
 
     return configuration_baseline_list
 
 def get_configuration_baseline_report(authenticated_headers: dict,
                            ome_ip_address: str,
-                           baseline_id: str = None
+                           baseline_id: str = None,
+                           select: list = None
                            ):
     """
     Gets a configuration baseline summary report from OME
@@ -209,18 +933,20 @@ def get_configuration_baseline_report(authenticated_headers: dict,
         authenticated_headers: A dictionary of HTTP headers generated from an authenticated session with OME
         ome_ip_address: IP address of the OME server
         baseline_id: Id of Baseline
+        select: An optional list of the properties to return for each device in the report
     """
 
     configuration_baselines = \
-        get_data(authenticated_headers, "https://%s/api/TemplateService/Baselines(%s)/DeviceConfigComplianceReports" % (ome_ip_address, baseline_id))  # type: dict
+        get_data_pushdown(authenticated_headers, "https://%s/api/TemplateService/Baselines(%s)/DeviceConfigComplianceReports" % (ome_ip_address, baseline_id), select=select)  # type: list
 
     if not configuration_baselines:
         print("Unable to retrieve configuration list from %s. This could happen for many reasons but the most likely is a"
-              " failure in the connection." % ome_ip_address)
+              " failure in the connection." % ome_ip_address, file=sys.stderr)
         exit(0)
 
     if len(configuration_baselines) <= 0:
-        print("No configuration baselines found on this OME server: " + ome_ip_address + ". Exiting.")
+        print("No configuration baselines found on this OME server: " + ome_ip_address + ". Exiting.",
+              file=sys.stderr)
         exit(0)
 
     configuration_baseline_list = []  # type: list
@@ -229,46 +955,365 @@ def get_configuration_baseline_report(authenticated_headers: dict,
 
     return configuration_baseline_list
 
+def get_device_compliance_details(authenticated_headers: dict,
+                                  ome_ip_address: str,
+                                  baseline_id: str,
+                                  report_entry_id: str
+                                  ) -> dict:
+    """
+    Gets the compliance details for a single device in a configuration baseline report
+
+    Args:
+        authenticated_headers: A dictionary of HTTP headers generated from an authenticated session with OME
+        ome_ip_address: IP address of the OME server
+        baseline_id: Id of Baseline
+        report_entry_id: Id of the device entry in the baseline compliance report
+    """
+
+    return get_data(authenticated_headers, "https://%s/api/TemplateService/Baselines(%s)/DeviceConfigComplianceReports(%s)/DeviceComplianceDetails" % (ome_ip_address, baseline_id, report_entry_id))  # type: dict
+
+def iter_device_compliance_details(authenticated_headers: dict,
+                                   ome_ip_address: str,
+                                   baseline_id: str,
+                                   report_entries,
+                                   workers: int = 8):
+    """
+    Fetches the compliance details for each device entry of a baseline compliance report concurrently and yields them
+    in report order. At most a few requests per worker are queued ahead so report_entries may itself be a generator.
+    A device whose details cannot be retrieved is yielded as a dictionary with its report Id and the error.
+
+    Args:
+        authenticated_headers: A dictionary of HTTP headers generated from an authenticated session with OME
+        ome_ip_address: IP address of the OME server
+        baseline_id: Id of Baseline
+        report_entries: An iterable of entries from the DeviceConfigComplianceReports collection
+        workers: The maximum number of device detail requests in flight at the same time
+    """
+
+    def fetch(configuration_baseline):
+        configuration_baseline_report_entry_id = configuration_baseline["Id"]
+        try:
+            return get_device_compliance_details(authenticated_headers, ome_ip_address, baseline_id,
+                                                 configuration_baseline_report_entry_id)
+        except Exception as err:
+            print("Unable to retrieve compliance details for report entry %s: %s"
+                  % (configuration_baseline_report_entry_id, err), file=sys.stderr)
+            return {"Id": configuration_baseline_report_entry_id, "Error": str(err)}
+
+    workers = max(1, workers)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for configuration_baseline in report_entries:
+            pending.append(executor.submit(fetch, configuration_baseline))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
 def get_configuration_baseline_detail_report(authenticated_headers: dict,
                            ome_ip_address: str,
-                           baseline_id: str = None
+                           baseline_id: str = None,
+                           workers: int = 8
                            ):
     """
-    Gets a configuration baseline detail report from OME
+    Gets a configuration baseline detail report from OME. The details for each device are fetched concurrently. A
+    device whose details cannot be retrieved does not stop the report; an entry with the device's report Id and the
+    error is returned in its place.
 
     Args:
         authenticated_headers: A dictionary of HTTP headers generated from an authenticated session with OME
         ome_ip_address: IP address of the OME server
         baseline_id: Id of Baseline
+        workers: The maximum number of device detail requests in flight at the same time
     """
 
+    # Only the Id of each report entry is needed to look up its details
     configuration_baselines = \
-        get_data(authenticated_headers, "https://%s/api/TemplateService/Baselines(%s)/DeviceConfigComplianceReports" % (ome_ip_address, baseline_id))  # type: dict
+        get_data_pushdown(authenticated_headers, "https://%s/api/TemplateService/Baselines(%s)/DeviceConfigComplianceReports" % (ome_ip_address, baseline_id), select=["Id"])  # type: list
 
     if not configuration_baselines:
         print("Unable to retrieve configuration list from %s. This could happen for many reasons but the most likely is a"
-              " failure in the connection." % ome_ip_address)
+              " failure in the connection." % ome_ip_address, file=sys.stderr)
         exit(0)
 
     if len(configuration_baselines) <= 0:
-        print("No configuration baselines found on this OME server: " + ome_ip_address + ". Exiting.")
+        print("No configuration baselines found on this OME server: " + ome_ip_address + ". Exiting.",
+              file=sys.stderr)
         exit(0)
 
-    configuration_baseline_list = []  # type: list
-    for configuration_baseline in configuration_baselines:
-        configuration_baseline_report_entry_id = configuration_baseline["Id"]
-        report_entry_detail = get_data(authenticated_headers, "https://%s/api/TemplateService/Baselines(%s)/DeviceConfigComplianceReports(%s)/DeviceComplianceDetails" % (ome_ip_address, baseline_id, configuration_baseline_report_entry_id))  # type: dict
+    configuration_baseline_list = list(iter_device_compliance_details(authenticated_headers, ome_ip_address,
+                                                                      baseline_id, configuration_baselines,
+                                                                      workers))  # type: list
 
-        configuration_baseline_list.append(report_entry_detail)
+    failed = [entry for entry in configuration_baseline_list if isinstance(entry, dict) and "Error" in entry]
+    if failed:
+        print("Failed to retrieve compliance details for %d of %d devices."
+              % (len(failed), len(configuration_baseline_list)), file=sys.stderr)
 
     return configuration_baseline_list
 
+def load_compliance_snapshot(snapshot_file: str, baseline_id) -> dict:
+    """
+    Loads the compliance snapshot saved by sync_configuration_baseline_report
+
+    Args:
+        snapshot_file: Path of the snapshot file
+        baseline_id: Id of Baseline. A snapshot taken for a different baseline is ignored
+
+    Returns: The snapshot, or an empty snapshot if there is none for this baseline
+    """
+
+    try:
+        with open(snapshot_file, encoding='utf-8') as snapshot:
+            saved = json.load(snapshot)
+        if str(saved.get('baseline_id')) == str(baseline_id):
+            return saved
+    except (OSError, ValueError):
+        pass
+    return {'baseline_id': baseline_id, 'watermark': None, 'entries': {}, 'details': {}}
+
+def save_compliance_snapshot(snapshot_file: str, snapshot: dict):
+    """
+    Saves a compliance snapshot. The file is replaced atomically so an interrupted run leaves the last snapshot intact.
+
+    Args:
+        snapshot_file: Path of the snapshot file
+        snapshot: The snapshot to save
+    """
+
+    snapshot_dir = os.path.dirname(os.path.abspath(snapshot_file))
+    fd, temp_path = tempfile.mkstemp(dir=snapshot_dir, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as snapshot_temp:
+        json.dump(snapshot, snapshot_temp)
+    os.replace(temp_path, snapshot_file)
+
+def sync_configuration_baseline_report(authenticated_headers: dict,
+                                       ome_ip_address: str,
+                                       baseline_id: str,
+                                       snapshot_file: str,
+                                       details: bool = False,
+                                       workers: int = 8,
+                                       timestamp_field: str = 'InventoryTime'
+                                       ) -> dict:
+    """
+    Incrementally updates a local snapshot of a configuration baseline compliance report. Only report entries whose
+    timestamp_field is newer than the newest one already in the snapshot are requested, using an OData filter. If OME
+    rejects the filter the full report is retrieved instead and compared with the snapshot. Either way only entries
+    that are new or whose ComplianceStatus or timestamp_field changed are merged, and with details=True only those
+    devices have their compliance details fetched again.
+
+    Devices removed from the baseline are dropped from the snapshot. When only the newer entries were requested, the
+    Ids still in the report are listed with $select=Id to find them.
+
+    Args:
+        authenticated_headers: A dictionary of HTTP headers generated from an authenticated session with OME
+        ome_ip_address: IP address of the OME server
+        baseline_id: Id of Baseline
+        snapshot_file: Path of the snapshot file. It is created on the first run
+        details: Also keep the compliance details of each device up to date
+        workers: The maximum number of device detail requests in flight at the same time
+        timestamp_field: The report entry property holding the time the device was last checked for compliance
+
+    Returns: The updated snapshot. 'entries' and 'details' are keyed by report entry Id and 'changed' lists the Ids
+        which changed in this run
+    """
+
+    report_url = "https://%s/api/TemplateService/Baselines(%s)/DeviceConfigComplianceReports" \
+                 % (ome_ip_address, baseline_id)
+    snapshot = load_compliance_snapshot(snapshot_file, baseline_id)
+    entries = snapshot['entries']
+
+    report_entries = None
+    full_report = True
+    if snapshot['watermark']:
+        try:
+            report_entries = list(iter_data(authenticated_headers, report_url,
+                                            "%s gt '%s'" % (timestamp_field, snapshot['watermark'])))
+            full_report = False
+        except Exception as err:
+            print("OME did not accept a filter on %s, retrieving the full report: %s" % (timestamp_field, err),
+                  file=sys.stderr)
+    if report_entries is None:
+        report_entries = list(iter_data(authenticated_headers, report_url))
+
+    changed = []
+    for entry in report_entries:
+        entry_id = str(entry["Id"])
+        previous = entries.get(entry_id)
+        if previous is None or previous.get("ComplianceStatus") != entry.get("ComplianceStatus") \
+                or previous.get(timestamp_field) != entry.get(timestamp_field):
+            changed.append(entry_id)
+        entries[entry_id] = entry
+
+    if full_report:
+        current_ids = set(str(entry["Id"]) for entry in report_entries)
+    else:
+        # Listed after the newer entries were retrieved so a device removed in between is still dropped
+        current_ids = set(str(entry["Id"]) for entry in
+                          get_data_pushdown(authenticated_headers, report_url, select=["Id"]))
+    for entry_id in list(entries):
+        if entry_id not in current_ids:
+            del entries[entry_id]
+            snapshot['details'].pop(entry_id, None)
+    changed = [entry_id for entry_id in changed if entry_id in entries]
+
+    if details:
+        # Devices that have never had their details fetched are included so the first run fills the snapshot
+        fetch_ids = changed + [entry_id for entry_id in entries
+                               if entry_id not in snapshot['details'] and entry_id not in changed]
+        fetch_entries = [entries[entry_id] for entry_id in fetch_ids]
+        for entry_id, report_entry_detail in zip(fetch_ids,
+                                                 iter_device_compliance_details(authenticated_headers,
+                                                                                ome_ip_address, baseline_id,
+                                                                                fetch_entries, workers)):
+            if isinstance(report_entry_detail, dict) and "Error" in report_entry_detail:
+                # Fetch it again next run
+                snapshot['details'].pop(entry_id, None)
+            else:
+                snapshot['details'][entry_id] = report_entry_detail
+
+    timestamps = [entry[timestamp_field] for entry in entries.values() if entry.get(timestamp_field)]
+    if timestamps:
+        snapshot['watermark'] = max(timestamps)
+    save_compliance_snapshot(snapshot_file, snapshot)
+
+    snapshot['changed'] = changed
+    return snapshot
+
+def write_ndjson(records, stream=sys.stdout) -> int:
+    """
+    Writes each record as a single line of JSON and flushes it immediately so downstream tools can consume the
+    output while it is still being retrieved
+
+    Args:
+        records: An iterable of JSON serialisable records
+        stream: The file object to write to
+
+    Returns: The number of records written
+    """
+
+    count = 0
+    for record in records:
+        stream.write(json.dumps(record) + '\n')
+        stream.flush()
+        count += 1
+    return count
+
+def find_configuration_baseline(authenticated_headers: dict, ome_ip_address: str, name: str):
+    """
+    Returns the configuration baseline with the given name. OME is asked for just that baseline's Id and Name.
+
+    Args:
+        authenticated_headers: A dictionary of HTTP headers generated from an authenticated session with OME
+        ome_ip_address: IP address of the OME server
+        name: Baseline Name
+
+    Returns: The baseline, or None if no baseline has that name
+    """
+
+    configuration_baselines = get_configuration_baselines(authenticated_headers, ome_ip_address, name,
+                                                          select=["Id", "Name"])
+    return configuration_baselines[0] if configuration_baselines else None
+
+def tag_appliance(record, ome_ip_address: str) -> dict:
+    """
+    Marks a record with the appliance it came from. Records that are not dictionaries, such as the list of
+    compliance details for a device, are wrapped.
+    """
+
+    if isinstance(record, dict):
+        tagged = {'Appliance': ome_ip_address}
+        tagged.update(record)
+        return tagged
+    return {'Appliance': ome_ip_address, 'value': record}
+
+def gather_appliance(ome_ip_address: str,
+                     ome_username: str,
+                     ome_password,
+                     baseline_name: str = None,
+                     get_baselines: bool = False,
+                     get_report: bool = False,
+                     get_detail_report: bool = False,
+                     detail_workers: int = 8,
+                     report_fields: list = None,
+                     token_file: str = None
+                     ) -> dict:
+    """
+    Logs in to one appliance and retrieves its baselines and compliance reports. Every record is tagged with the
+    appliance it came from. A failure is returned in 'error' instead of being raised so one unreachable appliance
+    does not stop the others.
+
+    Args:
+        ome_ip_address: IP address of the OME server
+        ome_username: Username for OME
+        ome_password: OME password, or a function returning it
+        baseline_name: Configuration Baseline name
+        get_baselines: Retrieve the list of configuration baselines
+        get_report: Retrieve the compliance report of baseline_name
+        get_detail_report: Retrieve the compliance details of every device in baseline_name
+        detail_workers: The maximum number of device detail requests in flight at the same time
+        report_fields: An optional list of the properties to return for each device in the report
+        token_file: Optional path the session token is saved to and loaded from
+
+    Returns: A dictionary with the appliance, its baselines, report and detail_report, and error
+    """
+
+    result = {'appliance': ome_ip_address, 'baselines': [], 'report': [], 'detail_report': [], 'error': None}
+    ome_session = OMESession(ome_ip_address, ome_username, ome_password, token_file=token_file)
+    client.appliance_auth[ome_ip_address] = ome_session
+    atexit.register(ome_session.close)
+    try:
+        headers = ome_session.login()
+        configuration_baselines = get_configuration_baselines(headers, ome_ip_address, baseline_name,
+                                                              None if get_baselines else ["Id", "Name"])
+        if get_baselines:
+            result['baselines'] = [tag_appliance(baseline, ome_ip_address) for baseline in configuration_baselines]
+        if configuration_baselines and (get_report or get_detail_report):
+            baseline_id = configuration_baselines[0]["Id"]
+            if get_report:
+                result['report'] = [tag_appliance(entry, ome_ip_address) for entry in
+                                    get_configuration_baseline_report(headers, ome_ip_address, baseline_id,
+                                                                      report_fields)]
+            if get_detail_report:
+                result['detail_report'] = [tag_appliance(entry, ome_ip_address) for entry in
+                                           get_configuration_baseline_detail_report(headers, ome_ip_address,
+                                                                                    baseline_id, detail_workers)]
+    except SystemExit:
+        # The report functions exit when an appliance has nothing to report, which only ends this appliance
+        result['error'] = "Unable to connect or no data was returned"
+    except Exception as err:
+        result['error'] = str(err) or err.__class__.__name__
+    return result
+
+def gather_appliances(ip_list: list, workers: int = None, **kwargs) -> list:
+    """
+    Runs gather_appliance against every appliance concurrently so the total time is close to that of the slowest
+    appliance rather than the sum of all of them
+
+    Args:
+        ip_list: IP addresses of the OME servers
+        workers: The maximum number of appliances worked on at the same time. Defaults to all of them
+        kwargs: Passed to gather_appliance
+
+    Returns: The result of gather_appliance for each appliance, in the order of ip_list
+    """
+
+    if not ip_list:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers or len(ip_list), len(ip_list)))) as executor:
+        return list(executor.map(lambda ome_ip_address: gather_appliance(ome_ip_address, **kwargs), ip_list))
+
 if __name__ == '__main__':
     urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
     parser = argparse.ArgumentParser(description=__doc__,
                                      formatter_class=RawTextHelpFormatter)
-    parser.add_argument("--ip", "-i", required=True, help="OME Appliance IP")
+    parser.add_argument("--ip", "-i", required=False, help="OME Appliance IP")
+    parser.add_argument("--ip-file", required=False,
+                        help="Text file of OME Appliance IPs separated by line breaks. All appliances are queried\n"
+                             "concurrently and the results are merged, each record tagged with its Appliance")
+    parser.add_argument("--appliance-workers", required=False, type=int, default=None,
+                        help="Maximum number of appliances queried at the same time with --ip-file. Defaults to all")
     parser.add_argument("--user", "-u", required=False,
                         help="Username for the OME Appliance", default="admin")
     parser.add_argument("--password", "-p", required=False,
@@ -281,50 +1326,217 @@ if __name__ == '__main__':
                         help="Get report for Configuration Baseline")
     parser.add_argument("--get-baseline-detail-report", "-d", required=False, action='store_true',
                         help="Get detail report for Configuration Baseline")
+    parser.add_argument("--pool-size", required=False, type=int, default=10,
+                        help="Number of HTTP connections kept open to OME")
+    parser.add_argument("--retries", required=False, type=int, default=3,
+                        help="Number of times to retry a request that failed with HTTP 429 or 5xx")
+    parser.add_argument("--no-keep-alive", required=False, action='store_true',
+                        help="Close the HTTP connection to OME after every request")
+    parser.add_argument("--page-size", required=False, type=int, default=None,
+                        help="Number of results to request from OME per page ($top)")
+    parser.add_argument("--page-workers", required=False, type=int, default=None,
+                        help="Fetch pages concurrently using $skip/$top with this many requests in flight")
+    parser.add_argument("--detail-workers", required=False, type=int, default=8,
+                        help="Number of devices whose compliance details are fetched in parallel for the detail report")
+    parser.add_argument("--output", "-o", required=False, choices=['print', 'ndjson'], default='print',
+                        help="print: print each result as a Python list once it is complete (default)\n"
+                             "ndjson: stream one JSON record per line as results arrive")
+    parser.add_argument("--cache-dir", required=False, default=None,
+                        help="Cache OME responses in this directory so repeated runs skip unchanged data")
+    parser.add_argument("--cache-ttl", required=False, type=int, default=300,
+                        help="Seconds a cached response is used before it is revalidated with OME")
+    parser.add_argument("--cache-max-size", required=False, type=int, default=100,
+                        help="Maximum size of the response cache in MB")
+    parser.add_argument("--session-file", required=False, default=None,
+                        help="Save the OME session token to this file and reuse it on later runs instead of logging in.\n"
+                             "Only used with --ip")
+    parser.add_argument("--logout", required=False, action='store_true',
+                        help="Delete the OME session saved in --session-file and exit")
+    parser.add_argument("--snapshot", required=False, default=None,
+                        help="Keep the baseline report in this file and only retrieve devices whose compliance changed\n"
+                             "since the last run")
+    parser.add_argument("--metrics-file", required=False, default=None,
+                        help="Record the timing of every request to OME and write it to this file when the run ends")
+    parser.add_argument("--metrics-format", required=False, choices=METRICS_FORMATS, default='jsonl',
+                        help="jsonl: one JSON event per request (default)\n"
+                             "prometheus: a textfile for the node_exporter textfile collector")
+    parser.add_argument("--debug", required=False, action='store_true',
+                        help="Log every HTTP request and response")
+    parser.add_argument("--fields", required=False, default=None,
+                        help="Comma separated properties to return for each device in the baseline report.\n"
+                             "Example: --fields DeviceName,ServiceTag,ComplianceStatus")
     args = parser.parse_args()
 
-    if not args.password:
+    report_fields = [field.strip() for field in args.fields.split(',') if field.strip()] if args.fields else None
+
+    if bool(args.ip) == bool(args.ip_file):
+        parser.error("one of --ip or --ip-file must be specified")
+
+    if args.ip_file and (args.logout or args.snapshot):
+        parser.error("--logout and --snapshot can only be used with --ip")
+
+    if args.logout and not args.session_file:
+        parser.error("--logout requires --session-file")
+
+    if args.debug:
+        enable_debug_logging()
+        if args.output == 'ndjson':
+            # HTTP debugging is written to stdout and would corrupt the NDJSON stream
+            http.client.HTTPConnection.debuglevel = 0
+
+    cache = None
+    if args.cache_dir:
+        cache = ResponseCache(args.cache_dir, ttl=args.cache_ttl, max_size=args.cache_max_size * 1024 * 1024)
+    recorder = None
+    if args.metrics_file:
+        recorder = Metrics()
+        # Registered before the session so it runs after the session is closed and the logout is recorded too
+        atexit.register(recorder.export, args.metrics_file, args.metrics_format)
+    client = OMEClient(pool_size=args.pool_size, retries=args.retries, keep_alive=not args.no_keep_alive,
+                       cache=cache, metrics=recorder)
+    default_page_size = args.page_size
+    default_page_workers = args.page_workers
+
+    def prompt_password():
         if not sys.stdin.isatty():
             # notify user that they have a bad terminal
             # perhaps if os.name == 'nt': , prompt them to use winpty?
             print("Your terminal is not compatible with Python's getpass module. You will need to provide the"
                   " --password argument instead. See https://stackoverflow.com/a/58277159/4427375")
             sys.exit(0)
-        else:
-            password = getpass()
-    else:
-        password = args.password
+        return getpass()
 
     if args.get_baseline_report or args.get_baseline_detail_report:
         if not args.baseline:
             parser.error("--baseline must be specified")
 
-    headers = authenticate(args.ip, args.user, password)
+    if args.session_file and args.ip_file:
+        parser.error("--session-file cannot be used with --ip-file")
+
+    # With --session-file the password is only prompted for when there is no saved session to reuse
+    password = args.password
+    if not password and not args.session_file:
+        password = prompt_password()
+
+    if args.ip_file:
+        if not os.path.isfile(args.ip_file):
+            print("Invalid file")
+            sys.exit(0)
+        with open(args.ip_file, "r") as ip_file:
+            ip_list = [line.strip() for line in ip_file if line.strip()]
+        appliance_results = gather_appliances(ip_list, args.appliance_workers,
+                                              ome_username=args.user,
+                                              ome_password=password or prompt_password,
+                                              baseline_name=args.baseline,
+                                              get_baselines=args.get_baselines,
+                                              get_report=args.get_baseline_report,
+                                              get_detail_report=args.get_baseline_detail_report,
+                                              detail_workers=args.detail_workers,
+                                              report_fields=report_fields)
+        for appliance_result in appliance_results:
+            if appliance_result['error']:
+                print("Failed to retrieve data from %s: %s" % (appliance_result['appliance'],
+                                                               appliance_result['error']), file=sys.stderr)
+        for key, requested in (('baselines', args.get_baselines), ('report', args.get_baseline_report),
+                               ('detail_report', args.get_baseline_detail_report)):
+            if not requested:
+                continue
+            merged = [record for appliance_result in appliance_results for record in appliance_result[key]]
+            if args.output == 'ndjson':
+                write_ndjson(merged)
+            else:
+                print(merged)
+        client.close()
+        sys.exit(0)
+    ome_session = OMESession(args.ip, args.user, password or prompt_password, token_file=args.session_file)
+    client.auth = ome_session
+    atexit.register(ome_session.close)
+
+    if args.logout:
+        ome_session.logout()
+        sys.exit(0)
+
+    headers = ome_session.login()
 
     if not headers:
         exit(0)
 
+    if args.output == 'ndjson':
+        if args.get_baselines:
+            if args.baseline:
+                write_ndjson(get_configuration_baselines(headers, args.ip, args.baseline))
+            else:
+                write_ndjson(iter_data(headers, "https://%s/api/TemplateService/Baselines" % args.ip))
+
+        if args.get_baseline_report or args.get_baseline_detail_report:
+            configuration_baseline = find_configuration_baseline(headers, args.ip, args.baseline)
+            if configuration_baseline is None:
+                print("No configuration baselines found!", file=sys.stderr)
+            elif args.snapshot:
+                snapshot = sync_configuration_baseline_report(headers, args.ip, configuration_baseline["Id"],
+                                                              args.snapshot, args.get_baseline_detail_report,
+                                                              args.detail_workers)
+                print("%d of %d devices changed since the last run." % (len(snapshot['changed']),
+                                                                        len(snapshot['entries'])), file=sys.stderr)
+                if args.get_baseline_report:
+                    write_ndjson(snapshot['entries'].values())
+                if args.get_baseline_detail_report:
+                    write_ndjson(snapshot['details'].values())
+            else:
+                report_url = "https://%s/api/TemplateService/Baselines(%s)/DeviceConfigComplianceReports" \
+                             % (args.ip, configuration_baseline["Id"])
+                if args.get_baseline_report:
+                    write_ndjson(iter_data_pushdown(headers, report_url, report_fields))
+                if args.get_baseline_detail_report:
+                    write_ndjson(iter_device_compliance_details(headers, args.ip, configuration_baseline["Id"],
+                                                                iter_data_pushdown(headers, report_url, ["Id"]),
+                                                                args.detail_workers))
+        client.close()
+        sys.exit(0)
+
+    if args.get_baselines or args.get_baseline_report or args.get_baseline_detail_report:
+        # Retrieved once and shared by every requested action
+        # The report paths only need the Id of the baseline
+        configuration_baselines = get_configuration_baselines(headers, args.ip, args.baseline,
+                                                              None if args.get_baselines else ["Id", "Name"])
+
     if args.get_baselines:
-        configuration_baselines = get_configuration_baselines(headers, args.ip, args.baseline)
         if len(configuration_baselines) > 0:
             print(configuration_baselines)
         else:
             print("No configuration baselines found!")
 
+    if args.snapshot and (args.get_baseline_report or args.get_baseline_detail_report):
+        if len(configuration_baselines) > 0:
+            snapshot = sync_configuration_baseline_report(headers, args.ip, configuration_baselines[0]["Id"],
+                                                          args.snapshot, args.get_baseline_detail_report,
+                                                          args.detail_workers)
+            print("%d of %d devices changed since the last run." % (len(snapshot['changed']),
+                                                                    len(snapshot['entries'])))
+            if args.get_baseline_report:
+                print(list(snapshot['entries'].values()))
+            if args.get_baseline_detail_report:
+                print(list(snapshot['details'].values()))
+        else:
+            print("No configuration baselines found!")
+        client.close()
+        sys.exit(0)
+
     if args.get_baseline_report:
-        configuration_baselines = get_configuration_baselines(headers, args.ip, args.baseline)
         if len(configuration_baselines) > 0:
             baseline_id = configuration_baselines[0]["Id"]
-            configuration_baseline_report = get_configuration_baseline_report(headers, args.ip, baseline_id)
+            configuration_baseline_report = get_configuration_baseline_report(headers, args.ip, baseline_id,
+                                                                              report_fields)
             print(configuration_baseline_report)
         else:
             print("No configuration baselines found!")
 
     if args.get_baseline_detail_report:
-        configuration_baselines = get_configuration_baselines(headers, args.ip, args.baseline)
         if len(configuration_baselines) > 0:
             baseline_id = configuration_baselines[0]["Id"]
-            configuration_baseline_report = get_configuration_baseline_report(headers, args.ip, baseline_id)
+            configuration_baseline_report = get_configuration_baseline_detail_report(headers, args.ip, baseline_id,
+                                                                                     args.detail_workers)
             print(configuration_baseline_report)
         else:
-            print("No configuration baselines found!")
\ No newline at end of file
+            print("No configuration baselines found!")
+    client.close()
@@ -0,0 +1,136 @@
+#
+# Copyright (c) 2022, Dell, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+"""
+#### Synopsis
+Host list loading and reachability checks shared by racadmLoop.py and scriptLoop.py.
+
+#### Description
+A host file has one entry per line. An entry can be:
+
+* a hostname or IP address - `idrac-r650-01.example.com`, `192.168.1.100`
+* a CIDR network - `192.168.1.0/28` expands to every usable address in the network
+* a range - `192.168.1.10-192.168.1.20` or `192.168.1.10-20`
+
+Blank lines are ignored and everything after a # is a comment. Duplicate hosts are dropped, keeping the first.
+
+probe_hosts() opens a TCP connection to every host concurrently so unreachable iDRACs are found in seconds instead
+of each one using up a worker for a full racadm or script timeout.
+"""
+
+import ipaddress
+import socket
+from concurrent.futures import ThreadPoolExecutor
+
+# Expanding a very large network by mistake would otherwise produce millions of hosts
+MAX_EXPANSION = 65536
+
+
+def expand_entry(entry: str) -> list:
+    """
+    Expands a single host file entry
+
+    Args:
+        entry: A hostname, IP address, CIDR network or range
+
+    Returns: The list of hosts the entry stands for
+
+    Raises:
+        ValueError: If a network or range is malformed or larger than MAX_EXPANSION addresses
+    """
+
+    if '/' in entry:
+        network = ipaddress.ip_network(entry, strict=False)
+        if network.num_addresses > MAX_EXPANSION:
+            raise ValueError("%s expands to more than %d addresses" % (entry, MAX_EXPANSION))
+        if network.num_addresses == 1:
+            return [str(network.network_address)]
+        return [str(address) for address in network.hosts()]
+
+    if '-' in entry:
+        start_text, end_text = entry.split('-', 1)
+        try:
+            start = ipaddress.ip_address(start_text.strip())
+        except ValueError:
+            # A hostname containing a dash, such as idrac-01
+            return [entry]
+        end_text = end_text.strip()
+        if end_text.isdigit() and start.version == 4:
+            # Short form, 192.168.1.10-20 only changes the last octet
+            end = ipaddress.ip_address(start_text.strip().rsplit('.', 1)[0] + '.' + end_text)
+        else:
+            end = ipaddress.ip_address(end_text)
+        if end.version != start.version or int(end) < int(start):
+            raise ValueError("Invalid range " + entry)
+        if int(end) - int(start) + 1 > MAX_EXPANSION:
+            raise ValueError("%s expands to more than %d addresses" % (entry, MAX_EXPANSION))
+        return [str(ipaddress.ip_address(value)) for value in range(int(start), int(end) + 1)]
+
+    return [entry]
+
+
+def load_hosts(path: str) -> list:
+    """
+    Reads a host file
+
+    Args:
+        path: The host file
+
+    Returns: Every host in the file, expanded and without duplicates, in file order
+
+    Raises:
+        ValueError: If a line cannot be parsed. The message includes the line number
+    """
+
+    hosts = []
+    seen = set()
+    with open(path, "r") as host_file:
+        for line_number, line in enumerate(host_file, 1):
+            entry = line.split('#', 1)[0].strip()
+            if not entry:
+                continue
+            try:
+                expanded = expand_entry(entry)
+            except ValueError as err:
+                raise ValueError("%s line %d: %s" % (path, line_number, err))
+            for host in expanded:
+                if host not in seen:
+                    seen.add(host)
+                    hosts.append(host)
+    return hosts
+
+
+def is_reachable(host: str, port: int = 443, timeout: float = 2) -> bool:
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def probe_hosts(hosts: list, port: int = 443, timeout: float = 2, workers: int = 256) -> tuple:
+    """
+    Checks which hosts accept a TCP connection on port
+
+    Args:
+        hosts: The hosts to check
+        port: The port to connect to. iDRAC serves racadm and Redfish on 443
+        timeout: Seconds to wait for each connection
+        workers: The maximum number of connections attempted at the same time
+
+    Returns: A tuple of the reachable and unreachable hosts, each in the order given
+    """
+
+    if not hosts:
+        return [], []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(hosts)))) as executor:
+        reachable = list(executor.map(lambda host: is_reachable(host, port, timeout), hosts))
+    return ([host for host, ok in zip(hosts, reachable) if ok],
+            [host for host, ok in zip(hosts, reachable) if not ok])
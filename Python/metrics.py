@@ -0,0 +1,168 @@
+#
+# Copyright (c) 2022, Dell, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+"""
+#### Synopsis
+Timing instrumentation shared by get_configuration_baselines.py, racadmLoop.py and scriptLoop.py.
+
+#### Description
+Each remote call (an OME request, a racadm command or a script run against one iDRAC) is recorded as an event.
+Every event has a kind, a target (the OME endpoint or the iDRAC), a duration in seconds and a status. At the end of
+a run the events are written either as JSON lines, one per event, or as a Prometheus textfile for the node_exporter
+textfile collector. Nothing is recorded unless the script was started with --metrics-file.
+"""
+
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+FORMATS = ['jsonl', 'prometheus']
+
+
+class Metrics:
+    """
+    Collects timing events from any number of threads
+    """
+
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+
+    def record(self, kind: str, target: str, duration: float, status=None, **fields) -> dict:
+        """
+        Records one remote call
+
+        Args:
+            kind: What was called, for example ome_request, racadm_command or script
+            target: The OME endpoint or iDRAC that was called
+            duration: Seconds the call took
+            status: The HTTP status or exit code. None if the call did not complete
+            fields: Any other values to keep with the event, such as bytes or retries
+
+        Returns: The recorded event
+        """
+
+        event = {'time': time.time(), 'kind': kind, 'target': target, 'duration': duration, 'status': status}
+        event.update(fields)
+        with self.lock:
+            self.events.append(event)
+        return event
+
+    def write_jsonl(self, path: str):
+        with self.lock:
+            events = list(self.events)
+        with open(path, 'w', encoding='utf-8') as metrics_file:
+            for event in events:
+                metrics_file.write(json.dumps(event) + '\n')
+
+    def write_prometheus(self, path: str):
+        with self.lock:
+            events = list(self.events)
+
+        totals = {}
+        hosts = {}
+        for event in events:
+            labels = (event['kind'], event['target'], str(event['status']))
+            total = totals.setdefault(labels, {'count': 0, 'seconds': 0.0, 'bytes': 0, 'retries': 0, 'pages': 0,
+                                                 'phases': {}})
+            total['count'] += 1
+            total['seconds'] += event['duration']
+            total['bytes'] += event.get('bytes') or 0
+            total['retries'] += event.get('retries') or 0
+            total['pages'] += 1 if event.get('page') else 0
+            for phase in ('connect', 'tls', 'ttfb'):
+                if event.get(phase) is not None:
+                    total['phases'][phase] = total['phases'].get(phase, 0.0) + event[phase]
+            if event.get('host'):
+                # The most recent call to each iDRAC, so slow or failing hosts can be found
+                hosts[(event['kind'], event['host'])] = event
+
+        lines = ['# HELP dell_scripts_requests_total Remote calls made',
+                 '# TYPE dell_scripts_requests_total counter']
+        lines += ['dell_scripts_requests_total{%s} %d' % (format_labels(kind=kind, target=target, status=status),
+                                                          total['count'])
+                  for (kind, target, status), total in sorted(totals.items())]
+        lines += ['# HELP dell_scripts_request_duration_seconds_total Seconds spent in remote calls',
+                  '# TYPE dell_scripts_request_duration_seconds_total counter']
+        lines += ['dell_scripts_request_duration_seconds_total{%s} %.6f'
+                  % (format_labels(kind=kind, target=target, status=status), total['seconds'])
+                  for (kind, target, status), total in sorted(totals.items())]
+        lines += ['# HELP dell_scripts_request_phase_seconds_total Seconds spent connecting (including DNS), in the '
+                  'TLS handshake and waiting for the first byte',
+                  '# TYPE dell_scripts_request_phase_seconds_total counter']
+        lines += ['dell_scripts_request_phase_seconds_total{%s} %.6f'
+                  % (format_labels(kind=kind, target=target, status=status, phase=phase), seconds)
+                  for (kind, target, status), total in sorted(totals.items())
+                  for phase, seconds in sorted(total['phases'].items())]
+        lines += ['# HELP dell_scripts_response_bytes_total Bytes received',
+                  '# TYPE dell_scripts_response_bytes_total counter']
+        lines += ['dell_scripts_response_bytes_total{%s} %d'
+                  % (format_labels(kind=kind, target=target, status=status), total['bytes'])
+                  for (kind, target, status), total in sorted(totals.items()) if total['bytes']]
+        lines += ['# HELP dell_scripts_pages_total Pages of OME collections retrieved',
+                  '# TYPE dell_scripts_pages_total counter']
+        lines += ['dell_scripts_pages_total{%s} %d'
+                  % (format_labels(kind=kind, target=target, status=status), total['pages'])
+                  for (kind, target, status), total in sorted(totals.items()) if total['pages']]
+        lines += ['# HELP dell_scripts_retries_total Requests retried after a 429, 5xx or expired session',
+                  '# TYPE dell_scripts_retries_total counter']
+        lines += ['dell_scripts_retries_total{%s} %d'
+                  % (format_labels(kind=kind, target=target, status=status), total['retries'])
+                  for (kind, target, status), total in sorted(totals.items()) if total['retries']]
+        lines += ['# HELP dell_scripts_host_duration_seconds Duration of the last call to each iDRAC',
+                  '# TYPE dell_scripts_host_duration_seconds gauge']
+        lines += ['dell_scripts_host_duration_seconds{%s} %.6f' % (format_labels(kind=kind, host=host),
+                                                                   event['duration'])
+                  for (kind, host), event in sorted(hosts.items())]
+        lines += ['# HELP dell_scripts_host_exit_code Exit code of the last call to each iDRAC, -1 if it did not '
+                  'finish',
+                  '# TYPE dell_scripts_host_exit_code gauge']
+        lines += ['dell_scripts_host_exit_code{%s} %d'
+                  % (format_labels(kind=kind, host=host), event['status'] if event['status'] is not None else -1)
+                  for (kind, host), event in sorted(hosts.items())]
+
+        # Written to a temporary file and renamed so the textfile collector never reads a partial file
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as metrics_file:
+            metrics_file.write('\n'.join(lines) + '\n')
+        os.replace(temp_path, path)
+
+    def export(self, path: str, output_format: str = 'jsonl'):
+        """
+        Writes every recorded event to path
+
+        Args:
+            path: File to write
+            output_format: jsonl for one JSON event per line or prometheus for a node_exporter textfile
+        """
+
+        if output_format == 'prometheus':
+            self.write_prometheus(path)
+        else:
+            self.write_jsonl(path)
+
+
+def format_labels(**labels) -> str:
+    return ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                    for name, value in labels.items())
+
+
+def endpoint(url: str) -> str:
+    """
+    Reduces an OME URL to its endpoint so requests for different pages and Ids are counted together. For example
+    https://ome/api/TemplateService/Baselines(12)/DeviceConfigComplianceReports?$skip=50 becomes
+    /api/TemplateService/Baselines(id)/DeviceConfigComplianceReports
+    """
+
+    path = re.sub(r'^[a-z]+://[^/]+', '', url).split('?', 1)[0]
+    return re.sub(r"\([^)]*\)", '(id)', path)
@@ -0,0 +1,211 @@
+#
+# Copyright (c) 2022, Dell, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+"""
+#### Synopsis
+Parses all TSR zip files in a directory and writes one CSV showing Service Tag, CPU and System Component Rollup.
+
+#### Description
+Python version of PowerShell/Parse-TSR.ps1 that runs on any OS. sysinfo_DCIM_View.xml is read straight out of each
+SupportAssist collection, including from the zip nested inside it, without extracting anything to disk. The XML is
+parsed incrementally and only the DCIM_SystemView and DCIM_CPUView instances are kept, so memory stays flat however
+large the inventory is. Archives are spread across a process pool because parsing is CPU bound.
+
+The CSV has the same columns as Parse-TSR.ps1 plus an Error column for archives that could not be read. Host is the
+path of the TSR zip. CPUInfo lists the model of every CPU separated by ; where Parse-TSR.ps1 printed an array.
+
+#### Python Example
+`python parse_tsr.py --tsr-dir /tmp/tsr`
+`python parse_tsr.py --tsr-dir /tmp/tsr --output rollup.csv --workers 8`
+"""
+
+import argparse
+import contextlib
+import csv
+import io
+import os
+import sys
+import zipfile
+import xml.etree.ElementTree as ElementTree
+from argparse import RawTextHelpFormatter
+from concurrent.futures import ProcessPoolExecutor
+
+SYSINFO_XML = 'sysinfo_DCIM_View.xml'
+
+ROLLUP_PROPERTIES = ['BatteryRollupStatus', 'CPURollupStatus', 'CurrentRollupStatus', 'FanRollupStatus',
+                     'IDSDMRollupStatus', 'IntrusionRollupStatus', 'LicensingRollupStatus', 'MemoryRollupStatus',
+                     'PSRollupStatus', 'RollupStatus', 'SDCardRollupStatus', 'SELRollupStatus',
+                     'StorageRollupStatus', 'TempRollupStatus', 'TempStatisticsRollupStatus', 'VoltRollupStatus']
+
+COLUMNS = ['Host', 'ServiceTag', 'LastSystemInventoryTime', 'CPUInfo'] + ROLLUP_PROPERTIES + ['Error']
+
+
+def open_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo):
+    """
+    Opens a zip nested inside another zip without extracting it to disk. A stored member is read in place because
+    seeking it is cheap. A compressed member has to be decompressed from the start on every backwards seek, which
+    ZipFile does several times, so it is read into memory once instead.
+    """
+
+    member = archive.open(info)
+    if info.compress_type == zipfile.ZIP_STORED:
+        return member
+    with member:
+        return io.BytesIO(member.read())
+
+
+def find_sysinfo(archive: zipfile.ZipFile, stack: contextlib.ExitStack, depth: int = 0):
+    """
+    Finds sysinfo_DCIM_View.xml in a TSR, looking inside nested zips
+
+    Args:
+        archive: The open TSR zip
+        stack: Nested zips that are opened are entered into stack so they stay open while the XML is read
+        depth: How many zips deep archive is
+
+    Returns: A file object to read the XML from or None if the archive does not contain it
+    """
+
+    infos = archive.infolist()
+    for info in infos:
+        if os.path.basename(info.filename) == SYSINFO_XML:
+            return stack.enter_context(archive.open(info))
+    if depth >= 2:
+        return None
+    for info in infos:
+        if info.filename.lower().endswith('.zip'):
+            inner = stack.enter_context(zipfile.ZipFile(open_member(archive, info)))
+            xml_file = find_sysinfo(inner, stack, depth + 1)
+            if xml_file is not None:
+                return xml_file
+    return None
+
+
+def display_value(prop) -> str:
+    """
+    Returns the DisplayValue of a PROPERTY element, falling back to VALUE
+    """
+
+    for tag in ('DisplayValue', 'VALUE'):
+        child = prop.find(tag)
+        if child is not None and child.text is not None:
+            return child.text.strip()
+    return None
+
+
+def parse_sysinfo(xml_file) -> dict:
+    """
+    Reads the Service Tag, CPU models and rollup statuses from sysinfo_DCIM_View.xml
+
+    Args:
+        xml_file: A file object for the XML
+
+    Returns: A dictionary with a value for each column of COLUMNS that comes from the XML
+    """
+
+    row = {}
+    cpus = []
+    parents = []
+    for event, element in ElementTree.iterparse(xml_file, events=('start', 'end')):
+        if event == 'start':
+            parents.append(element)
+            continue
+        parents.pop()
+        if element.tag == 'INSTANCE':
+            class_name = element.get('CLASSNAME')
+            if class_name == 'DCIM_SystemView':
+                for prop in element.iter('PROPERTY'):
+                    name = prop.get('NAME')
+                    if name in ROLLUP_PROPERTIES or name in ('ServiceTag', 'LastSystemInventoryTime'):
+                        row[name] = display_value(prop)
+            elif class_name == 'DCIM_CPUView':
+                cpus += [display_value(prop) for prop in element.iter('PROPERTY')
+                         if (prop.get('NAME') or '').endswith('Model') and display_value(prop)]
+        if element.tag in ('INSTANCE', 'VALUE.NAMEDINSTANCE') and parents:
+            # Drop instances already looked at so the tree never holds the whole inventory
+            element.clear()
+            parents[-1].remove(element)
+    row['CPUInfo'] = '; '.join(cpus)
+    return row
+
+
+def parse_tsr(path: str) -> dict:
+    """
+    Parses one TSR zip
+
+    Args:
+        path: The TSR zip file
+
+    Returns: A dictionary with a value for every column of COLUMNS. Error is set if the TSR could not be read
+    """
+
+    row = {column: None for column in COLUMNS}
+    row['Host'] = path
+    try:
+        with contextlib.ExitStack() as stack:
+            xml_file = find_sysinfo(stack.enter_context(zipfile.ZipFile(path)), stack)
+            if xml_file is None:
+                row['Error'] = "%s not found" % SYSINFO_XML
+                return row
+            row.update(parse_sysinfo(xml_file))
+    except Exception as err:
+        # An encrypted member or unsupported compression method raises RuntimeError or NotImplementedError, and any
+        # exception escaping here would stop executor.map and with it every other TSR
+        row['Error'] = str(err) or err.__class__.__name__
+    return row
+
+
+def parse_tsr_dir(tsr_dir: str, workers: int = None):
+    """
+    Parses every TSR zip in a directory
+
+    Args:
+        tsr_dir: Directory containing TSR collection zip files
+        workers: Number of processes. Defaults to the number of CPUs
+
+    Yields: The row for each TSR, in file name order
+    """
+
+    paths = sorted(os.path.join(tsr_dir, name) for name in os.listdir(tsr_dir)
+                   if name.lower().endswith('.zip') and os.path.isfile(os.path.join(tsr_dir, name)))
+    if not paths:
+        return
+    if workers == 1:
+        yield from map(parse_tsr, paths)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(parse_tsr, paths, chunksize=4)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
+    parser.add_argument("--tsr-dir", "-d", required=True, help="Directory containing TSR collection zip files")
+    parser.add_argument("--output", "-o", required=False,
+                        help="CSV file to write. Defaults to Output.csv in --tsr-dir like Parse-TSR.ps1")
+    parser.add_argument("--workers", required=False, type=int, default=None,
+                        help="Number of TSRs parsed in parallel. Defaults to the number of CPUs")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.tsr_dir):
+        parser.error("Invalid directory " + args.tsr_dir)
+    output = args.output or os.path.join(args.tsr_dir, 'Output.csv')
+
+    parsed = 0
+    failed = 0
+    with open(output, 'w', newline='', encoding='utf-8') as output_file:
+        writer = csv.DictWriter(output_file, fieldnames=COLUMNS)
+        writer.writeheader()
+        for row in parse_tsr_dir(args.tsr_dir, args.workers):
+            writer.writerow(row)
+            parsed += 1
+            if row['Error']:
+                failed += 1
+                print("%s: %s" % (row['Host'], row['Error']), file=sys.stderr)
+    print("Parsed %d TSRs, %d failed. Wrote %s" % (parsed, failed, output))
@@ -1,4 +1,3 @@
-
 # _author_ = Trevor Squillario <Trevor.Squillario@Dell.com>
 #
 # Copyright (c) 2019, Dell, Inc.
@@ -12,15 +11,50 @@
 
 # System Requirements
 # Python 3.x
-import argparse, os.path, subprocess, getpass 
+import argparse, os.path, subprocess, getpass, shlex, sys, threading, time, json
+from concurrent.futures import ThreadPoolExecutor
+try:
+    # Optional, only needed for --ssh
+    import paramiko
+except ImportError:
+    paramiko = None
+from metrics import Metrics, FORMATS as METRICS_FORMATS
+from checkpoint import Checkpoint
+import racadm_output
+from racadm_output import ColumnarWriter, parse_output, FORMATS as EXPORT_FORMATS
+from hosts import load_hosts, probe_hosts
 
 #Arguments passed into script based on flag
 parser=argparse.ArgumentParser(description="Python script to execute racadm commands on multiple servers")
-parser.add_argument('--command', help='racadm command to execute. Example: --command "get BIOS.BiosBootSettings"', required=True)
+parser.add_argument('--command', help='racadm command to execute. Can be given more than once. Example: --command "get BIOS.BiosBootSettings"', action='append', default=[])
+parser.add_argument('--commands-file', help='Text file of racadm commands separated by line breaks, all run against each iDRAC. Example: --commands-file commands.txt', required=False)
+parser.add_argument('--ssh', help='Run all commands for an iDRAC over one SSH session instead of logging in with remote racadm for every command. Requires paramiko', action='store_true')
+parser.add_argument('--output', help='text: print each iDRAC\'s output as one block. ndjson: print one JSON result per command', choices=['text', 'ndjson'], default='text')
 parser.add_argument('--user', help='Username used to login to iDRAC. Example: --user root', required=True)
-parser.add_argument('--file', help='Specify a text file of IP Addresses or Hostnames separated by line breaks. Example: --file devices.txt', required=True)
+parser.add_argument('--password', help='Password used to login to iDRAC. If not given you will be prompted for it', required=False)
+parser.add_argument('--file', help='Specify a text file of IP Addresses, Hostnames, CIDR networks (192.168.1.0/28) or ranges (192.168.1.10-20) separated by line breaks. # starts a comment. Example: --file devices.txt', required=True)
+parser.add_argument('--workers', help='Number of iDRACs to run the command against in parallel. Example: --workers 32', type=int, default=1)
+parser.add_argument('--timeout', help='Seconds to wait for each racadm command to finish on an iDRAC. With --ssh this is also the login timeout. Example: --timeout 120', type=int, default=300)
+parser.add_argument('--rate', help='Maximum number of racadm sessions started per second across all workers, 0 for no limit. Each remote racadm command is a session, with --ssh each iDRAC login is. Example: --rate 10', type=float, default=0)
+parser.add_argument('--metrics-file', help='Record the duration and exit code of every racadm command and write them to this file at the end of the run. Example: --metrics-file racadm.prom', required=False)
+parser.add_argument('--metrics-format', help='jsonl: one JSON event per command. prometheus: a textfile for the node_exporter textfile collector', choices=METRICS_FORMATS, default='jsonl')
+parser.add_argument('--export', help='Parse the output of every command and write it from all iDRACs to this file, one row per attribute. Example: --export settings.csv', required=False)
+parser.add_argument('--export-format', help='Format of the --export file. parquet requires pyarrow', choices=EXPORT_FORMATS, default='csv')
+parser.add_argument('--checkpoint', help='Journal file each iDRAC is recorded in as soon as it finishes. Defaults to <file>.checkpoint when --resume or --retry-failed is used. Example: --checkpoint racadm.checkpoint', required=False)
+parser.add_argument('--resume', help='Skip iDRACs the checkpoint journal shows already succeeded with the same commands', action='store_true')
+parser.add_argument('--retry-failed', help='Only run iDRACs the checkpoint journal shows failed with the same commands', action='store_true')
+parser.add_argument('--no-probe', help='Do not check every iDRAC accepts a TCP connection before running commands', action='store_true')
+parser.add_argument('--probe-port', help='Port checked before running commands. Defaults to 22 with --ssh, otherwise 443. Example: --probe-port 443', type=int, default=None)
+parser.add_argument('--probe-timeout', help='Seconds to wait for each iDRAC to accept a connection. Example: --probe-timeout 2', type=float, default=2)
 args=parser.parse_args()
 
+if not args.command and not args.commands_file:
+    parser.error("--command or --commands-file is required")
+if args.export and args.export_format == 'parquet' and racadm_output.pyarrow is None:
+    parser.error("--export-format parquet requires the pyarrow module. Install it with: pip install pyarrow")
+if args.ssh and paramiko is None:
+    parser.error("--ssh requires the paramiko module. Install it with: pip install paramiko")
+
 ###
 # Script Variables
 ###
@@ -28,55 +62,182 @@ args=parser.parse_args()
 # Credential to attempt to login to iDRAC with
 default_idrac_username = args.user
 default_idrac_password = ""
-default_idrac_command = args.command
+default_idrac_commands = list(args.command)
+if args.commands_file:
+    with open(args.commands_file, "r") as commands_file:
+        default_idrac_commands += [line.strip() for line in commands_file if line.strip() and not line.startswith('#')]
 
 ###
 # Start of Script
 ###
-def run_command(command):
-    raw_command = command.rstrip('\n')
-    output = subprocess.run(raw_command, stdout=subprocess.PIPE, universal_newlines=True, encoding='utf-8')
+class RateLimiter:
+    """Spaces out racadm session starts so a large worker pool does not hammer the network all at once"""
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.lock = threading.Lock()
+        self.next_start = time.monotonic()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+def run_command(command, timeout=None):
+    output = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, encoding='utf-8', timeout=timeout)
     return output
 
-# Main function to login to iDRAC, if successfull change credentials. Accepts array of IPs
-def execute_command(dracs):
-    # Loop through each IP
-    for dracip in dracs:
+# Only set when --metrics-file is given
+recorder = Metrics() if args.metrics_file else None
+
+# Only set when --checkpoint, --resume or --retry-failed is given
+checkpoint_file = args.checkpoint or (args.file + '.checkpoint' if args.resume or args.retry_failed else None)
+checkpoint = Checkpoint(checkpoint_file, '\n'.join(default_idrac_commands) + ('\nssh' if args.ssh else '')) if checkpoint_file else None
+
+def command_result(dracip, command, returncode, output, error=None, started=None):
+    duration = time.monotonic() - started if started is not None else None
+    return {'host': dracip, 'command': command, 'returncode': returncode, 'output': output, 'error': error, 'duration': duration}
+
+# Run each racadm command against a single iDRAC with remote racadm. Every command logs in to the iDRAC again
+def execute_host_racadm(dracip, commands, limiter=None):
+    results = []
+    for idrac_command in commands:
+        if limiter:
+            limiter.wait()
+        started = time.monotonic()
         try:
-            msg = "Trying to login to " + dracip + " as " + default_idrac_username
-            print(msg)
-            command_result = run_command('racadm --nocertwarn -r %s -u %s -p \"%s\" %s' % (dracip, default_idrac_username, default_idrac_password, default_idrac_command))
-            if command_result.returncode == 0: # Command successed
-                print(command_result.stdout)
+            command = ['racadm', '--nocertwarn', '-r', dracip, '-u', default_idrac_username, '-p', default_idrac_password] + shlex.split(idrac_command)
+            result = run_command(command, args.timeout)
+            if result.returncode == 0: # Command successed
+                results.append(command_result(dracip, idrac_command, result.returncode, result.stdout, started=started))
             else:
                 # log IPs where credentials cannot be authorized
-                msg = "Unable to connect to " + dracip
-                print(msg)
+                results.append(command_result(dracip, idrac_command, result.returncode, result.stdout, "Unable to connect to " + dracip, started))
+        except subprocess.TimeoutExpired:
+            results.append(command_result(dracip, idrac_command, None, "", "Timed out after %s seconds waiting for %s" % (args.timeout, dracip), started))
         except FileNotFoundError as err:
             #Log IPs that cannot establish a connection
-            msg = "Unable to find racadm executable"
-            print(msg)
-            print(err)
-            continue
+            results.append(command_result(dracip, idrac_command, None, "", "Unable to find racadm executable: " + str(err), started))
+            break
+    return results
+
+# Run every racadm command against a single iDRAC over one SSH session so the login is only done once
+def execute_host_ssh(dracip, commands, limiter=None):
+    results = []
+    if limiter:
+        limiter.wait()
+    ssh = paramiko.SSHClient()
+    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    started = time.monotonic()
+    try:
+        ssh.connect(dracip, username=default_idrac_username, password=default_idrac_password, timeout=args.timeout, look_for_keys=False, allow_agent=False)
+    except Exception as err:
+        # log IPs where credentials cannot be authorized
+        ssh.close()
+        if recorder:
+            recorder.record('ssh_login', dracip, time.monotonic() - started, None, host=dracip, error=str(err))
+        return [command_result(dracip, idrac_command, None, "", "Unable to connect to %s: %s" % (dracip, err)) for idrac_command in commands]
+    if recorder:
+        recorder.record('ssh_login', dracip, time.monotonic() - started, 0, host=dracip)
+    try:
+        for idrac_command in commands:
+            started = time.monotonic()
+            try:
+                # Each command runs on its own channel of the already authenticated connection
+                stdin, stdout, stderr = ssh.exec_command('racadm ' + idrac_command, timeout=args.timeout)
+                output = stdout.read().decode('utf-8', errors='replace') + stderr.read().decode('utf-8', errors='replace')
+                results.append(command_result(dracip, idrac_command, stdout.channel.recv_exit_status(), output, started=started))
+            except Exception as err:
+                results.append(command_result(dracip, idrac_command, None, "", "Command failed on %s: %s" % (dracip, err), started))
+    finally:
+        ssh.close()
+    return results
+
+# Run the racadm commands against a single iDRAC. Results are collected and returned so parallel runs don't interleave
+def execute_host(dracip, limiter=None):
+    if args.ssh:
+        results = execute_host_ssh(dracip, default_idrac_commands, limiter)
+    else:
+        results = execute_host_racadm(dracip, default_idrac_commands, limiter)
+    # Parsed here so the work is spread across the worker threads
+    for result in results:
+        result['records'] = parse_output(result['output'])
+    if recorder:
+        for result in results:
+            recorder.record('racadm_command', dracip, result['duration'] or 0, result['returncode'], host=dracip, command=result['command'], error=result['error'])
+    if checkpoint:
+        checkpoint.record(dracip, all(result['returncode'] == 0 for result in results), returncodes=[result['returncode'] for result in results])
+    return results
+
+def format_results(dracip, results):
+    output = []
+    output.append("Trying to login to " + dracip + " as " + default_idrac_username)
+    for result in results:
+        if len(default_idrac_commands) > 1:
+            output.append("racadm " + result['command'])
+        if result['output']:
+            output.append(result['output'])
+        if result['error']:
+            output.append(result['error'])
+    return "\n".join(output)
+
+# Main function to login to iDRAC and execute command. Accepts array of IPs
+def execute_command(dracs):
+    limiter = RateLimiter(args.rate)
+    workers = max(1, args.workers)
+    # map() yields results in input order, so each host's output is printed as one block in the order of the file
+    writer = ColumnarWriter(args.export, args.export_format) if args.export else None
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for dracip, results in zip(dracs, executor.map(lambda dracip: execute_host(dracip, limiter), dracs)):
+                if writer:
+                    for result in results:
+                        writer.write_result(result)
+                if args.output == 'ndjson':
+                    for result in results:
+                        print(json.dumps(result), flush=True)
+                else:
+                    print(format_results(dracip, results))
+    finally:
+        if writer:
+            writer.close()
+            print("Wrote %d rows to %s" % (writer.rows, args.export), file=sys.stderr)
 
 # Get IPs from Input File
 if args.file:
     if(os.path.isfile(args.file)):
-        ip_list= []
-        ip_file= open(args.file, "r")
-        while True:
-            ip_line = ip_file.readline().rstrip("\n")
-            ip_list.append(ip_line)
-            if not ip_line:
-                break
-        del ip_list[-1]
+        try:
+            ip_list = load_hosts(args.file)
+        except ValueError as err:
+            parser.error(str(err))
 
         # Prompt for password
-        default_idrac_password = getpass.getpass() 
-        
+        default_idrac_password = args.password if args.password else getpass.getpass()
+
+        if checkpoint:
+            total = len(ip_list)
+            ip_list = checkpoint.select(ip_list, args.resume, args.retry_failed)
+            print("Running %d of %d iDRACs, checkpoint journal %s" % (len(ip_list), total, checkpoint_file),
+                  file=sys.stderr)
+
+        # Skip iDRACs that are down instead of waiting for racadm to time out on each one
+        if not args.no_probe:
+            probe_port = args.probe_port or (22 if args.ssh else 443)
+            ip_list, unreachable = probe_hosts(ip_list, probe_port, args.probe_timeout)
+            for dracip in unreachable:
+                print("%s: unreachable on port %d, skipped" % (dracip, probe_port), file=sys.stderr)
+                if checkpoint:
+                    checkpoint.record(dracip, False, error='unreachable')
+
         # Execute command
         execute_command(ip_list)
-
-        ip_file.close()
+        if checkpoint:
+            checkpoint.close()
+        if recorder:
+            recorder.export(args.metrics_file, args.metrics_format)
     else:
-        print("Invalid file")
\ No newline at end of file
+        print("Invalid file")
@@ -0,0 +1,162 @@
+#
+# Copyright (c) 2022, Dell, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+"""
+#### Synopsis
+Parses racadm output into records and writes results from many iDRACs to one CSV or Parquet file.
+
+#### Description
+parse_output() understands the key=value layouts racadm uses:
+
+* `racadm get` - sections headed by [Key=iDRAC.Embedded.1#NIC.1] followed by Attribute=Value lines. Read only
+  attributes are prefixed with # in the output and are reported with read_only set.
+* `racadm hwinventory` - sections headed by [InstanceID: CPU.Socket.1] followed by Name = Value lines
+* `racadm lclog view` and similar - Name = Value lines with entries separated by lines of dashes or blank lines
+
+Every attribute becomes one row of host, command, record, section, attribute, value, read_only. This long layout is
+written in a single pass as results arrive and pivots easily, for example to compare one setting across the fleet.
+Parquet output needs the optional pyarrow module.
+"""
+
+import csv
+import re
+
+try:
+    # Optional, only needed for Parquet output
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+COLUMNS = ['host', 'command', 'returncode', 'record', 'section', 'attribute', 'value', 'read_only']
+FORMATS = ['csv', 'parquet']
+
+SECTION_HEADER = re.compile(r'^\[(?:Key=|InstanceID:\s*)?(.*?)\]$')
+SEPARATOR = re.compile(r'^-{3,}$|^={3,}$')
+
+
+def parse_output(output: str) -> list:
+    """
+    Parses racadm output into records
+
+    Args:
+        output: The text racadm printed
+
+    Returns: A list of records. Each record is a dictionary with the section it came from, if the output had section
+        headers, an attributes dictionary of name to value and a read_only list of the attributes that are read only
+    """
+
+    records = []
+    record = None
+    section = None
+    for raw_line in (output or '').splitlines():
+        line = raw_line.strip()
+        if not line or SEPARATOR.match(line):
+            # A blank line or a row of dashes ends the current entry in lclog style output
+            if record is not None and record['attributes'] and section is None:
+                records.append(record)
+                record = None
+            continue
+        header = SECTION_HEADER.match(line)
+        if header:
+            if record is not None and record['attributes']:
+                records.append(record)
+            section = header.group(1).strip()
+            record = {'section': section, 'attributes': {}, 'read_only': []}
+            continue
+        if '=' not in line:
+            continue
+        name, value = line.split('=', 1)
+        name = name.strip()
+        read_only = name.startswith('#')
+        if read_only:
+            name = name[1:].strip()
+        if not name:
+            continue
+        if record is None:
+            record = {'section': section, 'attributes': {}, 'read_only': []}
+        record['attributes'][name] = value.strip()
+        if read_only:
+            record['read_only'].append(name)
+    if record is not None and record['attributes']:
+        records.append(record)
+    return records
+
+
+def result_rows(result: dict):
+    """
+    Turns one racadm command result into rows for the columnar file
+
+    Args:
+        result: A result dictionary from racadmLoop.py with host, command, returncode and output
+
+    Yields: A dictionary per attribute with a value for every column in COLUMNS
+    """
+
+    records = result.get('records')
+    if records is None:
+        records = parse_output(result.get('output'))
+    for index, record in enumerate(records):
+        for name, value in record['attributes'].items():
+            yield {'host': result['host'], 'command': result['command'], 'returncode': result['returncode'],
+                   'record': index, 'section': record['section'], 'attribute': name, 'value': value,
+                   'read_only': name in record['read_only']}
+
+
+class ColumnarWriter:
+    """
+    Writes racadm results from every host to one file as they arrive
+
+    Args:
+        path: File to write
+        output_format: csv or parquet
+        row_group_size: Number of rows buffered before a Parquet row group is written
+    """
+
+    def __init__(self, path: str, output_format: str = 'csv', row_group_size: int = 10000):
+        if output_format == 'parquet' and pyarrow is None:
+            raise Exception("Parquet output requires the pyarrow module. Install it with: pip install pyarrow")
+        self.output_format = output_format
+        self.row_group_size = row_group_size
+        self.rows = 0
+        if output_format == 'parquet':
+            self.schema = pyarrow.schema([('host', pyarrow.string()), ('command', pyarrow.string()),
+                                          ('returncode', pyarrow.int32()), ('record', pyarrow.int32()),
+                                          ('section', pyarrow.string()), ('attribute', pyarrow.string()),
+                                          ('value', pyarrow.string()), ('read_only', pyarrow.bool_())])
+            self.parquet_writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+            self.buffer = {column: [] for column in COLUMNS}
+        else:
+            self.file = open(path, 'w', newline='', encoding='utf-8')
+            self.csv_writer = csv.DictWriter(self.file, fieldnames=COLUMNS)
+            self.csv_writer.writeheader()
+
+    def write_result(self, result: dict):
+        for row in result_rows(result):
+            self.rows += 1
+            if self.output_format == 'parquet':
+                for column in COLUMNS:
+                    self.buffer[column].append(row[column])
+                if len(self.buffer['host']) >= self.row_group_size:
+                    self._flush()
+            else:
+                self.csv_writer.writerow(row)
+
+    def _flush(self):
+        if self.buffer['host']:
+            self.parquet_writer.write_table(pyarrow.table(self.buffer, schema=self.schema))
+            self.buffer = {column: [] for column in COLUMNS}
+
+    def close(self):
+        if self.output_format == 'parquet':
+            self._flush()
+            self.parquet_writer.close()
+        else:
+            self.file.close()
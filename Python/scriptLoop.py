@@ -10,32 +10,115 @@
 # http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
 
 # System Requirements
-# Python 3.x
-import argparse, os.path, subprocess, getpass, sys
+# Python 3.7+
+import argparse, os.path, getpass, sys, shlex, signal
+import asyncio, time
 import logging
+from metrics import Metrics, FORMATS as METRICS_FORMATS
+from checkpoint import Checkpoint
+from hosts import load_hosts, probe_hosts
 
 #Arguments passed into script based on flag
 parser=argparse.ArgumentParser(description="Python script to execute another Python script on multiple servers")
 parser.add_argument('-u', help='iDRAC username', required=True)
 parser.add_argument('-p', help='iDRAC password. If you do not pass in argument -p, script will prompt to enter user password which will not be echoed to the screen.', required=False)
-parser.add_argument('--file', help='Specify a text file of IP Addresses or Hostnames separated by line breaks. Example: --file devices.txt', required=True)
+parser.add_argument('--file', help='Specify a text file of IP Addresses, Hostnames, CIDR networks (192.168.1.0/28) or ranges (192.168.1.10-20) separated by line breaks. # starts a comment. Example: --file devices.txt', required=True)
+parser.add_argument('--workers', help='Number of scripts to run in parallel. Example: --workers 32', type=int, default=1)
+parser.add_argument('--command', help='Command to run for each iDRAC instead of the one defined in build_command(). {ip}, {user} and {password} are replaced. Example: --command "python3 GetFirmwareInventoryREDFISH.py -ip {ip} -u {user} -p {password}"', required=False)
+parser.add_argument('--timeout', help='Seconds a script may run against one iDRAC before it is killed. Example: --timeout 600', type=int, default=None)
+parser.add_argument('--metrics-file', help='Record the duration and exit code of the script for every iDRAC and write them to this file at the end of the run. Example: --metrics-file scripts.prom', required=False)
+parser.add_argument('--metrics-format', help='jsonl: one JSON event per iDRAC. prometheus: a textfile for the node_exporter textfile collector', choices=METRICS_FORMATS, default='jsonl')
+parser.add_argument('--checkpoint', help='Journal file each iDRAC is recorded in as soon as its script finishes. Defaults to <file>.checkpoint when --resume or --retry-failed is used. Example: --checkpoint scripts.checkpoint', required=False)
+parser.add_argument('--resume', help='Skip iDRACs the checkpoint journal shows already succeeded with the same command', action='store_true')
+parser.add_argument('--retry-failed', help='Only run iDRACs the checkpoint journal shows failed with the same command', action='store_true')
+parser.add_argument('--no-probe', help='Do not check every iDRAC accepts a TCP connection before running scripts', action='store_true')
+parser.add_argument('--probe-port', help='Port checked before running scripts. Example: --probe-port 443', type=int, default=443)
+parser.add_argument('--probe-timeout', help='Seconds to wait for each iDRAC to accept a connection. Example: --probe-timeout 2', type=float, default=2)
 args=parser.parse_args()
 
-def run_command(command):
-    raw_command = command.rstrip('\n')
-    output = subprocess.run(raw_command, stdout=subprocess.PIPE, universal_newlines=True, encoding='utf-8', shell=True)
-    return output
+# Only set when --metrics-file is given
+recorder = Metrics() if args.metrics_file else None
 
-def execute_script(dracip, command):
-    msg = "Trying to login to " + dracip
-    print(msg)
-    command_result = run_command(command)
-    if command_result.returncode == 0: # Command successed
-        print(command_result.stdout)
+def build_command(dracip, idrac_username, idrac_password):
+    if args.command:
+        return args.command.format(ip=shlex.quote(dracip), user=shlex.quote(idrac_username), password=shlex.quote(idrac_password))
+    # Define command
+    #command = "python3 '/home/user/git/iDRAC-Redfish-Scripting/Redfish Python/InstallFromRepositoryREDFISH.py' -ip '%s' -u '%s' -p '%s' --install --shareip downloads.dell.com --sharetype HTTPS --applyupdate True --rebootneeded True" % (dracip, idrac_username, idrac_password)
+    command = "python3 '/home/user/git/iDRAC-Redfish-Scripting/Redfish Python/GetIdracLcSystemAttributesREDFISH.py' -ip '%s' -u '%s' -p '%s' --group-name 'idrac' --attribute-name 'NIC.1.DNSRacName'" % (dracip, idrac_username, idrac_password)
+    return command
+
+async def stream_output(dracip, stream):
+    # Print each line as soon as the child writes it, prefixed with the host so parallel output can be told apart.
+    # Read in chunks rather than with readline() so a line longer than the StreamReader limit, such as a JSON dump,
+    # does not fail the host.
+    pending = b''
+    while True:
+        chunk = await stream.read(65536)
+        if not chunk:
+            break
+        pending += chunk
+        if b'\n' not in chunk:
+            continue
+        lines = pending.split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            print("[%s] %s" % (dracip, line.decode('utf-8', errors='replace').rstrip('\r')), flush=True)
+    if pending:
+        print("[%s] %s" % (dracip, pending.decode('utf-8', errors='replace').rstrip('\r')), flush=True)
+
+def kill_process(process):
+    # Children are started in their own process group on POSIX so anything they spawned is killed with them
+    if os.name == 'posix':
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
     else:
+        process.kill()
+
+async def execute_script(dracip, command, timeout=None):
+    msg = "Trying to login to " + dracip
+    print(msg, flush=True)
+    started = time.monotonic()
+    process = await asyncio.create_subprocess_exec(*shlex.split(command), stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT, start_new_session=(os.name == 'posix'))
+    try:
+        try:
+            await asyncio.wait_for(asyncio.gather(stream_output(dracip, process.stdout), process.wait()), timeout)
+        except asyncio.TimeoutError:
+            # Kill stragglers so one hung iDRAC doesn't hold a worker slot forever
+            kill_process(process)
+            await process.wait()
+            print("Timed out after %s seconds on %s" % (timeout, dracip), flush=True)
+            if recorder:
+                recorder.record('script', dracip, time.monotonic() - started, None, host=dracip, timed_out=True)
+            return process.returncode
+    finally:
+        # The child runs in its own session so it would outlive an error or Ctrl-C here unless it is killed
+        if process.returncode is None:
+            kill_process(process)
+            await process.wait()
+    if recorder:
+        recorder.record('script', dracip, time.monotonic() - started, process.returncode, host=dracip)
+    if process.returncode != 0:
         # log IPs where credentials cannot be authorized
         msg = "Unable to connect to " + dracip
-        print(msg)
+        print(msg, flush=True)
+    return process.returncode
+
+async def execute_all(ip_list, idrac_username, idrac_password, workers=1, timeout=None, checkpoint=None):
+    semaphore = asyncio.Semaphore(max(1, workers))
+
+    async def run(dracip):
+        async with semaphore:
+            returncode = None
+            try:
+                returncode = await execute_script(dracip, build_command(dracip, idrac_username, idrac_password), timeout)
+            except Exception as err:
+                print("Unable to run script for %s: %s" % (dracip, err), flush=True)
+            if checkpoint:
+                checkpoint.record(dracip, returncode == 0, returncode=returncode)
+
+    await asyncio.gather(*(run(dracip) for dracip in ip_list))
 
 if __name__ == "__main__":
     idrac_username = args.u
@@ -47,25 +130,32 @@ if __name__ == "__main__":
     # Get IPs from Input File
     if args.file:
         if(os.path.isfile(args.file)):
-            ip_list= []
-            ip_file= open(args.file, "r")
-            while True:
-                ip_line = ip_file.readline().rstrip("\n")
-                ip_list.append(ip_line)
-                if not ip_line:
-                    break
-            del ip_list[-1] 
+            try:
+                ip_list = load_hosts(args.file)
+            except ValueError as err:
+                parser.error(str(err))
+
+            checkpoint = None
+            checkpoint_file = args.checkpoint or (args.file + '.checkpoint' if args.resume or args.retry_failed else None)
+            if checkpoint_file:
+                # The password is left out so changing it does not invalidate the journal
+                checkpoint = Checkpoint(checkpoint_file, build_command('{ip}', idrac_username, ''))
+                total = len(ip_list)
+                ip_list = checkpoint.select(ip_list, args.resume, args.retry_failed)
+                print("Running %d of %d iDRACs, checkpoint journal %s" % (len(ip_list), total, checkpoint_file), flush=True)
 
-            for dracip in ip_list:
-                try:
-                    # Define command
-                    #command = "python3 '/home/user/git/iDRAC-Redfish-Scripting/Redfish Python/InstallFromRepositoryREDFISH.py' -ip '%s' -u '%s' -p '%s' --install --shareip downloads.dell.com --sharetype HTTPS --applyupdate True --rebootneeded True" % (dracip, idrac_username, idrac_password)
-                    command = "python3 '/home/user/git/iDRAC-Redfish-Scripting/Redfish Python/GetIdracLcSystemAttributesREDFISH.py' -ip '%s' -u '%s' -p '%s' --group-name 'idrac' --attribute-name 'NIC.1.DNSRacName'" % (dracip, idrac_username, idrac_password)
-                    # Execute command
-                    execute_script(dracip, command)
-                except:
-                    continue
+            # Skip iDRACs that are down instead of waiting for the script to time out on each one
+            if not args.no_probe:
+                ip_list, unreachable = probe_hosts(ip_list, args.probe_port, args.probe_timeout)
+                for ip in unreachable:
+                    print("%s: unreachable on port %d, skipped" % (ip, args.probe_port), flush=True)
+                    if checkpoint:
+                        checkpoint.record(ip, False, error='unreachable')
 
-            ip_file.close()
+            asyncio.run(execute_all(ip_list, idrac_username, idrac_password, args.workers, args.timeout, checkpoint))
+            if checkpoint:
+                checkpoint.close()
+            if recorder:
+                recorder.export(args.metrics_file, args.metrics_format)
         else:
             print("Invalid file")
@@ -0,0 +1,532 @@
+#
+# Copyright (c) 2022, Dell, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+"""
+#### Synopsis
+Polls the sensors of many iDRACs on a schedule and keeps their history in a local time-series store.
+
+#### Description
+A long running version of PowerShell/Get-SensorReadings.ps1 for a whole fleet. Every --interval seconds the Redfish
+Sensors collection of each iDRAC in --file is read, up to --workers iDRACs at a time, with one request per iDRAC
+where the firmware supports $expand. Only readings that changed by more than --deadband are stored, plus one
+reading every --heartbeat seconds so a flat sensor still shows it was being polled.
+
+The store is a directory of append-only segment files, one per UTC day. A segment holds fixed size binary records:
+13 bytes per reading after the series (iDRAC and sensor) is defined once in the segment. Segments older than
+--raw-days are downsampled to the min, max and mean of each series per --downsample seconds and the raw segment is
+removed. A segment cut short by a crash is truncated to its last complete record the next time it is opened.
+
+Memory does not grow with the length of the run. The collector keeps the last stored reading of each series, about
+160 bytes a series, and refuses new series beyond --max-series. Results are written as each iDRAC finishes and at
+most twice --workers iDRACs are in flight, and the HTTP connection pool only keeps --workers iDRACs open.
+
+Use --export to write everything in the store to CSV.
+
+#### Python Example
+`python sensor_collector.py --file hosts.txt --user root --password calvin --store /var/lib/idrac-sensors`
+`python sensor_collector.py --store /var/lib/idrac-sensors --export sensors.csv --host 192.168.1.100`
+"""
+
+import argparse
+import csv
+import heapq
+import json
+import os
+import re
+import signal
+import struct
+import sys
+import threading
+import time
+from argparse import RawTextHelpFormatter
+from array import array
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+from getpass import getpass
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from hosts import load_hosts
+
+SENSORS_URL = 'https://%s/redfish/v1/Chassis/System.Embedded.1/Sensors'
+
+MAGIC = b'DSTS1\n'
+SERIES = struct.Struct('<IH')
+POINT = struct.Struct('<IIf')
+AGGREGATE = struct.Struct('<IIfffH')
+SEGMENT_NAME = re.compile(r'^(raw|agg\d+)-(\d{8})\.tsdb$')
+# Statuses an iDRAC answers a query option it does not support with
+EXPAND_UNSUPPORTED = (400, 405, 501)
+# Order of the fields in the metadata tuple kept in memory for each series
+META_FIELDS = ('host', 'sensor', 'name', 'type', 'units')
+
+
+def read_segment(path: str):
+    """
+    Reads the records of a segment file
+
+    Args:
+        path: The segment file
+
+    Yields: Tuples of the record type and its fields. ('S', series_id, meta), ('P', series_id, time, value) or
+        ('A', series_id, bucket, minimum, maximum, mean, count). The byte offset after the last complete record is
+        yielded last as ('E', offset)
+    """
+
+    with open(path, 'rb') as segment:
+        if segment.read(len(MAGIC)) != MAGIC:
+            yield 'E', 0
+            return
+        offset = len(MAGIC)
+        while True:
+            record_type = segment.read(1)
+            if record_type == b'P':
+                data = segment.read(POINT.size)
+                if len(data) < POINT.size:
+                    break
+                yield ('P',) + POINT.unpack(data)
+                offset += 1 + POINT.size
+            elif record_type == b'S':
+                data = segment.read(SERIES.size)
+                if len(data) < SERIES.size:
+                    break
+                series_id, length = SERIES.unpack(data)
+                meta = segment.read(length)
+                if len(meta) < length:
+                    break
+                yield 'S', series_id, json.loads(meta.decode('utf-8'))
+                offset += 1 + SERIES.size + length
+            elif record_type == b'A':
+                data = segment.read(AGGREGATE.size)
+                if len(data) < AGGREGATE.size:
+                    break
+                yield ('A',) + AGGREGATE.unpack(data)
+                offset += 1 + AGGREGATE.size
+            else:
+                # End of file, or a record that was only partly written
+                break
+    yield 'E', offset
+
+
+class SegmentWriter:
+    """
+    Appends records to one segment file, writing each series definition the first time the series is used in it
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.defined = set()
+        end = None
+        if os.path.exists(path):
+            for record in read_segment(path):
+                if record[0] == 'S':
+                    self.defined.add(record[1])
+                elif record[0] == 'E':
+                    end = record[1]
+        self.file = open(path, 'r+b' if end else 'wb')
+        if end:
+            self.file.truncate(end)
+            self.file.seek(end)
+        else:
+            self.file.write(MAGIC)
+
+    def define(self, series_id: int, meta: dict):
+        if series_id not in self.defined:
+            data = json.dumps(meta, separators=(',', ':')).encode('utf-8')
+            self.file.write(b'S' + SERIES.pack(series_id, len(data)) + data)
+            self.defined.add(series_id)
+
+    def point(self, series_id: int, timestamp: int, value: float):
+        self.file.write(b'P' + POINT.pack(series_id, timestamp, value))
+
+    def aggregate(self, series_id: int, bucket: int, minimum: float, maximum: float, total: float, count: int):
+        self.file.write(b'A' + AGGREGATE.pack(series_id, bucket, minimum, maximum, total / count, min(count, 65535)))
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+class TimeSeriesStore:
+    """
+    Directory of daily append-only segments holding sensor readings
+
+    Args:
+        directory: Where the segments are kept. It is created if it does not exist
+        max_series: The most series tracked. Readings for series beyond this are dropped
+    """
+
+    def __init__(self, directory: str, max_series: int = 500000):
+        self.directory = directory
+        self.max_series = max_series
+        os.makedirs(directory, exist_ok=True)
+        # Series id of each sensor, by iDRAC then sensor Id
+        self.series_ids = {}
+        self.series_count = 0
+        # Tuple of META_FIELDS for each series, indexed by series id. The strings are interned since the same names,
+        # types and units repeat on every iDRAC
+        self.meta = []
+        # Last stored value and time of each series, indexed by series id
+        self.last_value = array('f')
+        self.last_time = array('I')
+        self.writer = None
+        self.day = None
+        self.load()
+
+    def segments(self) -> list:
+        """
+        Returns: Tuples of day, kind and path for every segment, oldest first with downsampled before raw
+        """
+
+        found = []
+        for name in os.listdir(self.directory):
+            match = SEGMENT_NAME.match(name)
+            if match:
+                found.append((match.group(2), match.group(1), os.path.join(self.directory, name)))
+        return sorted(found, key=lambda segment: (segment[0], segment[1] == 'raw'))
+
+    def load(self):
+        """
+        Rebuilds the series table from the existing segments, and the last stored values from the newest raw segment
+        so a restart does not store every reading again
+        """
+
+        segments = self.segments()
+        raw = [path for _, kind, path in segments if kind == 'raw']
+        for _, kind, path in segments:
+            for record in read_segment(path):
+                if record[0] == 'S':
+                    self.register(record[1], record[2])
+                elif record[0] == 'P' and raw and path == raw[-1] and record[1] < len(self.meta):
+                    self.last_value[record[1]] = record[3]
+                    self.last_time[record[1]] = record[2]
+
+    def register(self, series_id: int, meta: dict):
+        meta = tuple(sys.intern(value) if isinstance(value, str) else value
+                     for value in (meta.get(field) for field in META_FIELDS))
+        host_ids = self.series_ids.setdefault(meta[0], {})
+        if meta[1] in host_ids:
+            return
+        while len(self.meta) <= series_id:
+            self.meta.append(None)
+            self.last_value.append(0.0)
+            self.last_time.append(0)
+        self.meta[series_id] = meta
+        host_ids[meta[1]] = series_id
+        self.series_count += 1
+
+    def series(self, host: str, sensor: dict):
+        """
+        Returns: The id of the series for a sensor on host, creating it if needed. None if --max-series is reached
+        """
+
+        series_id = self.series_ids.get(host, {}).get(sensor['Id'])
+        if series_id is None:
+            if self.series_count >= self.max_series:
+                return None
+            series_id = len(self.meta)
+            self.register(series_id, {'host': host, 'sensor': sensor['Id'], 'name': sensor.get('Name'),
+                                      'type': sensor.get('ReadingType'), 'units': sensor.get('ReadingUnits')})
+        return series_id
+
+    def segment_writer(self, timestamp: int) -> SegmentWriter:
+        day = datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y%m%d')
+        if day != self.day:
+            if self.writer:
+                self.writer.close()
+            self.writer = SegmentWriter(os.path.join(self.directory, 'raw-%s.tsdb' % day))
+            self.day = day
+        return self.writer
+
+    def append(self, series_id: int, timestamp: int, value: float):
+        writer = self.segment_writer(timestamp)
+        writer.define(series_id, dict(zip(META_FIELDS, self.meta[series_id])))
+        writer.point(series_id, timestamp, value)
+        self.last_value[series_id] = value
+        self.last_time[series_id] = timestamp
+
+    def is_changed(self, series_id: int, timestamp: int, value: float, deadband: float, heartbeat: int) -> bool:
+        if not self.last_time[series_id]:
+            return True
+        # Compared as float32 because that is how readings are stored
+        stored = struct.unpack('<f', struct.pack('<f', value))[0]
+        return abs(stored - self.last_value[series_id]) > deadband or \
+            timestamp - self.last_time[series_id] >= heartbeat
+
+    def flush(self):
+        if self.writer:
+            self.writer.flush()
+
+    def downsample(self, raw_days: int, bucket_seconds: int):
+        """
+        Replaces raw segments older than raw_days with the min, max and mean of each series per bucket_seconds
+        """
+
+        cutoff = datetime.fromtimestamp(time.time() - raw_days * 86400, timezone.utc).strftime('%Y%m%d')
+        for day, kind, path in self.segments():
+            if kind == 'raw' and day < cutoff and day != self.day:
+                downsample_segment(path, os.path.join(self.directory, 'agg%d-%s.tsdb' % (bucket_seconds, day)),
+                                   bucket_seconds)
+                os.remove(path)
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+
+
+def downsample_segment(path: str, output: str, bucket_seconds: int):
+    """
+    Writes the min, max and mean of each series per bucket_seconds in a raw segment to a new segment
+
+    Readings are appended roughly in time order, so a bucket is written once a reading two buckets later arrives and
+    only the open buckets are held in memory. The open bucket start times are kept in a heap so finding the ones to
+    write does not mean looking at every open bucket.
+    """
+
+    temp_path = output + '.tmp'
+    writer = SegmentWriter(temp_path)
+    metas = {}
+    # Aggregate of each series by bucket start time, and a heap of the start times
+    open_buckets = {}
+    starts = []
+
+    def write_bucket(bucket):
+        for series_id, (minimum, maximum, total, count) in open_buckets.pop(bucket).items():
+            writer.define(series_id, metas[series_id])
+            writer.aggregate(series_id, bucket, minimum, maximum, total, count)
+
+    for record in read_segment(path):
+        if record[0] == 'S':
+            metas[record[1]] = record[2]
+        elif record[0] == 'P':
+            _, series_id, timestamp, value = record
+            bucket = timestamp - timestamp % bucket_seconds
+            series_buckets = open_buckets.get(bucket)
+            if series_buckets is None:
+                series_buckets = open_buckets[bucket] = {}
+                heapq.heappush(starts, bucket)
+                while starts[0] < bucket - bucket_seconds:
+                    write_bucket(heapq.heappop(starts))
+            aggregate = series_buckets.get(series_id)
+            if aggregate is None:
+                series_buckets[series_id] = [value, value, value, 1]
+            else:
+                aggregate[0] = min(aggregate[0], value)
+                aggregate[1] = max(aggregate[1], value)
+                aggregate[2] += value
+                aggregate[3] += 1
+    while starts:
+        write_bucket(heapq.heappop(starts))
+    writer.flush()
+    writer.close()
+    os.replace(temp_path, output)
+
+
+def get_sensors(session: requests.Session, host: str, timeout: float, expand: dict) -> list:
+    """
+    Reads every sensor of an iDRAC
+
+    Args:
+        session: The shared HTTP session
+        host: The iDRAC
+        timeout: Seconds to wait for each request
+        expand: Remembers per iDRAC whether $expand is supported so older firmware is not asked every poll
+
+    Returns: The sensor resources, each with at least Id and Reading
+    """
+
+    url = SENSORS_URL % host
+    response = None
+    if expand.get(host, True):
+        response = session.get(url, params={'$expand': '*($levels=1)'}, timeout=timeout, verify=False)
+        if response.status_code in EXPAND_UNSUPPORTED:
+            # Some firmware rejects $expand with an error instead of ignoring it, so try again without it
+            response = None
+        else:
+            # Any other error, such as a busy iDRAC answering 503 or 429, says nothing about $expand
+            response.raise_for_status()
+    if response is None:
+        response = session.get(url, timeout=timeout, verify=False)
+        response.raise_for_status()
+        expand[host] = False
+    members = response.json().get('Members', [])
+    if members and 'Reading' not in members[0]:
+        # Firmware without $expand returns links only, so each sensor is read separately like Get-SensorReadings.ps1
+        expand[host] = False
+        sensors = []
+        for member in members:
+            sensor_response = session.get('https://%s%s' % (host, member['@odata.id']), timeout=timeout,
+                                          verify=False)
+            sensor_response.raise_for_status()
+            sensors.append(sensor_response.json())
+        members = sensors
+    return [member for member in members if member.get('Id') and isinstance(member.get('Reading'), (int, float))]
+
+
+def poll(session: requests.Session, host: str, timeout: float, expand: dict) -> tuple:
+    try:
+        return host, int(time.time()), get_sensors(session, host, timeout, expand), None
+    except (requests.exceptions.RequestException, ValueError) as err:
+        return host, int(time.time()), None, err
+
+
+def collect(session: requests.Session, store: TimeSeriesStore, ip_list: list, args, expand: dict,
+            stop: threading.Event = None) -> dict:
+    """
+    Polls every iDRAC once and stores the readings that changed. If stop is set no more iDRACs are started
+
+    Returns: Counts of the iDRACs polled, failed, readings seen and readings stored
+    """
+
+    summary = {'hosts': 0, 'failed': 0, 'readings': 0, 'stored': 0, 'dropped': 0}
+    hosts = iter(ip_list)
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        pending = set()
+        while True:
+            # At most twice the workers are queued so results never pile up in memory
+            while len(pending) < args.workers * 2:
+                host = next(hosts, None) if not (stop and stop.is_set()) else None
+                if host is None:
+                    break
+                pending.add(executor.submit(poll, session, host, args.timeout, expand))
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                host, timestamp, sensors, error = future.result()
+                summary['hosts'] += 1
+                if error is not None:
+                    summary['failed'] += 1
+                    print("%s: %s" % (host, error), file=sys.stderr)
+                    continue
+                for sensor in sensors:
+                    summary['readings'] += 1
+                    series_id = store.series(host, sensor)
+                    if series_id is None:
+                        summary['dropped'] += 1
+                        continue
+                    if store.is_changed(series_id, timestamp, sensor['Reading'], args.deadband, args.heartbeat):
+                        store.append(series_id, timestamp, sensor['Reading'])
+                        summary['stored'] += 1
+    store.flush()
+    return summary
+
+
+def export_csv(store: TimeSeriesStore, path: str, host: str = None):
+    """
+    Writes every reading and downsampled bucket in the store to a CSV file, optionally only for one iDRAC
+    """
+
+    with open(path, 'w', newline='', encoding='utf-8') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(['Host', 'Id', 'Name', 'ReadingType', 'ReadingUnits', 'Time', 'Reading', 'Min', 'Max',
+                         'Count'])
+        for _, _, segment in store.segments():
+            for record in read_segment(segment):
+                if record[0] not in ('P', 'A'):
+                    continue
+                meta = store.meta[record[1]]
+                if meta is None or (host and meta[0] != host):
+                    continue
+                timestamp = datetime.fromtimestamp(record[2], timezone.utc).isoformat()
+                row = list(meta) + [timestamp]
+                if record[0] == 'P':
+                    writer.writerow(row + [round(record[3], 3), '', '', 1])
+                else:
+                    writer.writerow(row + [round(record[5], 3), round(record[3], 3), round(record[4], 3), record[6]])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
+    parser.add_argument("--store", required=True, help="Directory the time-series segments are kept in")
+    parser.add_argument("--file", required=False,
+                        help="Text file of iDRAC IP Addresses, Hostnames, CIDR networks or ranges to poll")
+    parser.add_argument("--user", "-u", required=False, help="Username used to login to iDRAC")
+    parser.add_argument("--password", "-p", required=False,
+                        help="Password used to login to iDRAC. If not given you will be prompted for it")
+    parser.add_argument("--interval", required=False, type=int, default=60,
+                        help="Seconds between the start of each poll of the whole fleet")
+    parser.add_argument("--cycles", required=False, type=int, default=0,
+                        help="Stop after this many polls. 0 runs until interrupted")
+    parser.add_argument("--workers", required=False, type=int, default=32,
+                        help="Number of iDRACs polled at the same time")
+    parser.add_argument("--timeout", required=False, type=float, default=10,
+                        help="Seconds to wait for each Redfish request")
+    parser.add_argument("--deadband", required=False, type=float, default=0,
+                        help="Store a reading only when it differs from the last stored one by more than this")
+    parser.add_argument("--heartbeat", required=False, type=int, default=3600,
+                        help="Store a reading at least this often in seconds even if it did not change")
+    parser.add_argument("--max-series", required=False, type=int, default=500000,
+                        help="Most iDRAC sensors tracked. Bounds memory at roughly 160 bytes per series")
+    parser.add_argument("--raw-days", required=False, type=int, default=7,
+                        help="Days every stored reading is kept before it is downsampled")
+    parser.add_argument("--downsample", required=False, type=int, default=300,
+                        help="Seconds per bucket when old readings are downsampled to min, max and mean")
+    parser.add_argument("--export", required=False, help="Write the store to this CSV file and exit")
+    parser.add_argument("--host", required=False, help="Only export readings of this iDRAC")
+    args = parser.parse_args()
+
+    store = TimeSeriesStore(args.store, args.max_series)
+    if args.export:
+        export_csv(store, args.export, args.host)
+        sys.exit(0)
+
+    if not args.file or not args.user:
+        parser.error("--file and --user are required unless --export is used")
+    try:
+        ip_list = load_hosts(args.file)
+    except (OSError, ValueError) as err:
+        parser.error(str(err))
+    password = args.password if args.password else getpass()
+
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    session = requests.Session()
+    session.auth = (args.user, password)
+    session.headers['Accept'] = 'application/json'
+    # Keep connections to at most --workers iDRACs open, one each, however large the fleet is
+    adapter = HTTPAdapter(pool_connections=args.workers, pool_maxsize=1)
+    session.mount('https://', adapter)
+
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    expand = {}
+    cycle = 0
+    downsampler = None
+    try:
+        while not stop.is_set():
+            started = time.monotonic()
+            if downsampler is None or not downsampler.is_alive():
+                # Downsampling a day of a large fleet takes a while, so it runs beside the polls instead of delaying
+                # them. It never touches the raw segment being written
+                downsampler = threading.Thread(target=store.downsample, args=(args.raw_days, args.downsample),
+                                               daemon=True)
+                downsampler.start()
+            summary = collect(session, store, ip_list, args, expand, stop)
+            cycle += 1
+            elapsed = time.monotonic() - started
+            print("Poll %d: %d iDRACs, %d failed, %d readings, %d stored, %d dropped over --max-series in %.1fs"
+                  % (cycle, summary['hosts'], summary['failed'], summary['readings'], summary['stored'],
+                     summary['dropped'], elapsed), flush=True)
+            if args.cycles and cycle >= args.cycles:
+                break
+            if elapsed > args.interval:
+                print("Poll took longer than --interval %ds, starting the next one now" % args.interval, flush=True)
+            stop.wait(max(0, args.interval - elapsed))
+    finally:
+        if downsampler is not None:
+            downsampler.join()
+        store.close()
+        session.close()